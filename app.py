@@ -1,25 +1,291 @@
 # lunashop.py
-from flask import Flask, request, redirect, url_for, session, flash, render_template_string, g
-import sqlite3, hashlib, os
-from datetime import datetime
+from flask import Flask, request, redirect, url_for, session, flash, render_template, g, jsonify, stream_with_context
+from flask import before_render_template, template_rendered, send_file, abort, stream_template
+from werkzeug.utils import safe_join
+from jinja2 import DictLoader
+from markupsafe import Markup, escape
+import sqlite3, hashlib, os, re, base64, time, json, secrets, queue, threading, functools, csv, bisect, heapq, zlib, gc, math
+import click, contextlib, itertools
+from datetime import datetime, timezone
+from collections import OrderedDict, Counter
 
 # ---------------- CONFIG ----------------
 app = Flask(__name__)
 app.secret_key = "supersecretkey_v3_college"
 DB = "ecommerce.db"
 PER_PAGE = 8
+ORDERS_PER_PAGE = 10
+AUTOCOMPLETE_LIMIT = 8      # suggestions per query by default
+AUTOCOMPLETE_MAX_LIMIT = 20 # most a client may ask for
+AUTOCOMPLETE_RERANK_SECONDS = 3600   # rebuild the index (popularity ranks) this often
+RELATED_PRODUCTS = 4     # "frequently bought together" shown on a product page
+RECOMMEND_BATCH = 5000   # orders folded into co_purchases per transaction
+SALES_DAYS = 30          # days of revenue on the admin dashboard
+TOP_PRODUCTS = 10        # best sellers on the admin dashboard
+COUNT_CACHE_SIZE = 1024
+PRICE_BUCKETS = (100, 500, 1000, 2500)   # price facet edges (₹): under 100, 100-500, ..., 2500 and up
+FEED_CHUNK_BYTES = 64 * 1024   # NDJSON feed is flushed to the client in chunks this size
+IMPORT_BATCH = 50000     # rows per transaction in import-catalog
+NAV_CHECK_SECONDS = 30   # how often the header re-checks the categories version
+PAGE_CACHE_BYTES = 64 * 1024 * 1024   # memory budget for cached anonymous pages
+PAGE_CACHE_TTL = 300                  # seconds a cached page may be served
+SLOW_REQUEST_MS = None   # log requests slower than this (with their SQL); None = off
+DB_POOL_SIZE = 8         # pooled read-only connections per process
+DB_WRITERS = 1           # pooled write connections per process
+DB_POOL_TIMEOUT = 10     # seconds to wait for a free connection
+SERVER_BIND = "127.0.0.1:8000"   # `flask serve` listen address
+SERVER_WORKERS = os.cpu_count() or 2   # pre-forked worker processes
+SERVER_THREADS = 4       # request threads per worker
+SERVER_GRACEFUL_TIMEOUT = 30   # seconds old workers get to finish on restart
+STREAM_CHUNK_BYTES = 16 * 1024   # streamed pages are flushed to the client in chunks this size
+GZIP_MIN_BYTES = 1024    # smaller responses are sent uncompressed
+GZIP_LEVEL = 6
+DB_PRAGMAS = {           # applied once when a pooled connection is opened
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -32000,   # KiB
+    'busy_timeout': 5000,   # ms
+}
 
 # ---------------- DB ----------------
-def get_db():
-    if 'db' not in g:
-        g.db = sqlite3.connect(DB)
-        g.db.row_factory = sqlite3.Row
-    return g.db
+# Connections are opened once, tuned with DB_PRAGMAS and reused across requests.
+# Readers are query_only; writes (checkout, registration, cart changes) go
+# through get_db(write=True), which hands out one of DB_WRITERS connections.
+def connect(path, readonly=False):
+    conn = sqlite3.connect(path, timeout=DB_PRAGMAS['busy_timeout'] / 1000, check_same_thread=False,
+                           factory=InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    for name, value in DB_PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    if readonly:
+        conn.execute("PRAGMA query_only=1")
+    return conn
+
+class ConnectionPool:
+    """At most `size` connections to one db file, idle ones reused most-recent first."""
+    def __init__(self, path, size, readonly=False):
+        self.path, self.readonly = path, readonly
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise RuntimeError(f"no free db connection after {DB_POOL_TIMEOUT}s")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return connect(self.path, self.readonly)
+            except Exception:
+                self._slots.release()
+                raise
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+        self._slots.release()
+
+_pools = {}
+_pools_lock = threading.Lock()
+_schema_ready = False
+
+def get_pool(readonly):
+    # keyed by pid so a forked worker never shares its parent's connections
+    key = (os.getpid(), DB, readonly)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(DB, DB_POOL_SIZE if readonly else DB_WRITERS, readonly)
+    return pool
+
+def get_db(write=False):
+    global _schema_ready
+    if not _schema_ready:
+        pool = get_pool(readonly=False)
+        conn = pool.acquire()
+        try:
+            migrate(conn)
+        finally:
+            pool.release(conn)
+        _schema_ready = True
+    name = 'write_db' if write else 'db'
+    if name not in g:
+        setattr(g, name, get_pool(readonly=not write).acquire())
+    return getattr(g, name)
 
 @app.teardown_appcontext
 def close_db(exc):
-    db = g.pop('db', None)
-    if db: db.close()
+    for name, readonly in (('db', True), ('write_db', False)):
+        conn = g.pop(name, None)
+        if conn: get_pool(readonly).release(conn)
+
+# ---------------- METRICS ----------------
+# Per request we record wall time, SQL statement count, SQL time (execute plus
+# fetch, via InstrumentedConnection/Cursor) and template render time, and keep
+# per-route histograms of each for /metrics (Prometheus text format). With
+# SLOW_REQUEST_MS set, slower requests are logged with the SQL they ran.
+# Figures are per process: under `serve` each worker keeps its own, so every
+# series (and /cache/stats) carries the worker's pid, and a scrape only ever
+# reports the worker that answered it. Sum over pid to get the whole server.
+_req = threading.local()
+
+class RequestStats:
+    __slots__ = ('start', 'sql_count', 'sql_time', 'render_time', 'render_start', 'statements')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count, self.sql_time, self.render_time, self.render_start = 0, 0.0, 0.0, None
+        self.statements = [] if SLOW_REQUEST_MS is not None else None
+
+    def add_sql(self, sql, seconds):
+        self.sql_count += 1
+        self.sql_time += seconds
+        if self.statements is not None and len(self.statements) < 100:
+            self.statements.append((sql, seconds))
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that charges statement and fetch time to the current request, if any."""
+    def _timed(self, method, sql, *args):
+        stats = getattr(_req, 'stats', None)
+        if stats is None:
+            return method(*args)
+        t0 = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if sql is None:
+                stats.sql_time += time.perf_counter() - t0
+            else:
+                stats.add_sql(sql, time.perf_counter() - t0)
+
+    def execute(self, sql, params=()):
+        return self._timed(super().execute, sql, sql, params)
+
+    def executemany(self, sql, seq):
+        return self._timed(super().executemany, sql, sql, seq)
+
+    def fetchone(self):
+        return self._timed(super().fetchone, None)
+
+    def fetchmany(self, size=None):
+        return self._timed(super().fetchmany, None, size or self.arraysize)
+
+    def fetchall(self):
+        return self._timed(super().fetchall, None)
+
+    def __next__(self):
+        return self._timed(super().__next__, None)
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+class Histogram:
+    """Prometheus histogram with a `route` label (and the process's `pid` when rendered)."""
+    def __init__(self, name, help, buckets):
+        self.name, self.help, self.buckets = name, help, buckets
+        self.series = {}   # route -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, route, value):
+        with self._lock:
+            s = self.series.setdefault(route, [0] * len(self.buckets) + [0.0, 0])
+            for i, le in enumerate(self.buckets):
+                if value <= le:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self, pid):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for route, s in sorted(self.series.items()):
+                labels = f'pid="{pid}",route="{route}"'
+                for le, n in zip(self.buckets, s):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {n}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {s[-1]}')
+                lines.append(f'{self.name}_sum{{{labels}}} {s[-2]:.6f}')
+                lines.append(f'{self.name}_count{{{labels}}} {s[-1]}')
+        return lines
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+METRICS = {
+    'wall': Histogram("lunashop_request_seconds", "Wall time per request.", SECONDS),
+    'sql_count': Histogram("lunashop_request_sql_statements", "SQL statements per request.", (0, 1, 2, 5, 10, 20, 50, 100, 250)),
+    'sql_time': Histogram("lunashop_request_sql_seconds", "Time in SQL (execute and fetch) per request.", SECONDS),
+    'render': Histogram("lunashop_request_render_seconds", "Template render time per request.", SECONDS),
+}
+_responses = {}   # (route, status) -> count
+_responses_lock = threading.Lock()
+
+@app.before_request
+def start_request_stats():
+    _req.stats = RequestStats()
+
+@before_render_template.connect_via(app)
+def _render_started(sender, template, context, **extra):
+    stats = getattr(_req, 'stats', None)
+    if stats: stats.render_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def _render_finished(sender, template, context, **extra):
+    stats = getattr(_req, 'stats', None)
+    if stats and stats.render_start is not None:
+        stats.render_time += time.perf_counter() - stats.render_start
+        stats.render_start = None
+
+@app.after_request
+def record_request_stats(resp):
+    stats = getattr(_req, 'stats', None)
+    if stats is None:
+        return resp
+    done = functools.partial(finish_request_stats, stats, request.endpoint or "unmatched", resp.status_code,
+                             request.method, request.full_path)
+    if resp.is_streamed:
+        resp.call_on_close(done)  # a streamed body renders (and queries) while it is sent
+    else:
+        done()
+    return resp
+
+def finish_request_stats(stats, route, status, method, path):
+    if getattr(_req, 'stats', None) is stats:
+        _req.stats = None
+    wall = time.perf_counter() - stats.start
+    METRICS['wall'].observe(route, wall)
+    METRICS['sql_count'].observe(route, stats.sql_count)
+    METRICS['sql_time'].observe(route, stats.sql_time)
+    METRICS['render'].observe(route, stats.render_time)
+    with _responses_lock:
+        _responses[(route, status)] = _responses.get((route, status), 0) + 1
+    if SLOW_REQUEST_MS is not None and wall * 1000 >= SLOW_REQUEST_MS:
+        sql = "\n".join(f"  {ms * 1000:8.2f} ms  {' '.join(q.split())}" for q, ms in stats.statements)
+        app.logger.warning("slow request %s %s: %.1f ms, %d SQL (%.1f ms), render %.1f ms\n%s",
+                           method, path, wall * 1000, stats.sql_count,
+                           stats.sql_time * 1000, stats.render_time * 1000, sql)
+
+@app.route('/metrics')
+def metrics():
+    pid, lines = os.getpid(), []
+    for hist in METRICS.values():
+        lines += hist.render(pid)
+    lines += ["# HELP lunashop_responses_total Responses by route and status.", "# TYPE lunashop_responses_total counter"]
+    with _responses_lock:
+        lines += [f'lunashop_responses_total{{pid="{pid}",route="{r}",status="{s}"}} {n}' for (r, s), n in sorted(_responses.items())]
+    for key, value in page_cache.stats().items():
+        kind = "counter" if key in ('hits', 'misses', 'evictions') else "gauge"
+        name = f"lunashop_page_cache_{key}" + ("_total" if kind == "counter" else "")
+        lines += [f"# TYPE {name} {kind}", f'{name}{{pid="{pid}"}} {value}']
+    return app.response_class("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
 
 # ---------------- HELPERS ----------------
 def hash_pw(pw):
@@ -31,94 +297,1563 @@ def paginate(query, params, page, per_page=PER_PAGE):
     rows = db.execute(query + " LIMIT ? OFFSET ?", params + (per_page, offset)).fetchall()
     return rows
 
-def site_base(title, body_html):
-    """Bootstrap 5 light theme header/footer — used for all pages (single-file HTML)."""
-    user_part = ""
-    if session.get('user_id'):
-        user_part = f"""
-            <span class="me-3">Hello, <strong>{session.get('username')}</strong></span>
-            <a class="btn btn-sm btn-outline-light me-2" href="{url_for('cart')}">🛒 Cart</a>
-            <a class="btn btn-sm btn-outline-light" href="{url_for('logout')}">Logout</a>
-        """
+# ---------------- CATALOG VERSION / COUNTS ----------------
+# Triggers bump catalog_meta.version (and stamp updated_at, unix seconds) on every
+# product or category write, so anything cached against the catalog can be
+# checked with one small read of catalog_meta.
+META_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0, updated_at INTEGER NOT NULL DEFAULT 0);
+INSERT OR IGNORE INTO catalog_meta (key, version, updated_at) VALUES ('products', 0, CAST(strftime('%s','now') AS INTEGER)), ('categories', 0, CAST(strftime('%s','now') AS INTEGER));
+""" + "".join(f"""
+DROP TRIGGER IF EXISTS {table}_version_{suffix};
+CREATE TRIGGER {table}_version_{suffix} AFTER {op} ON {table} BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='{table}';
+END;""" for table in ('products', 'categories') for suffix, op in (('ai', 'INSERT'), ('au', 'UPDATE'), ('ad', 'DELETE')))
+
+def catalog_stamp(key='products'):
+    """(version, updated_at) of the products (or other keyed) data; catalog_meta is read once per request."""
+    if 'catalog_meta' not in g:
+        g.catalog_meta = {r['key']: (r['version'], r['updated_at']) for r in get_db().execute("SELECT * FROM catalog_meta")}
+    return g.catalog_meta.get(key, (0, 0))
+
+def catalog_version(key='products'):
+    return catalog_stamp(key)[0]
+
+_count_cache = {}
+
+def cached_count(query, params=()):
+    """COUNT(*) result cached per (query, params) until the product catalog changes."""
+    version = catalog_version()
+    key = (query, params)
+    hit = _count_cache.get(key)
+    if hit and hit[0] == version:
+        return hit[1]
+    if len(_count_cache) >= COUNT_CACHE_SIZE:
+        _count_cache.clear()
+    count = get_db().execute(query, params).fetchone()[0]
+    _count_cache[key] = (version, count)
+    return count
+
+# ---------------- KEYSET PAGINATION ----------------
+# Cursors are opaque url-safe tokens holding [direction, page, *key]: "n" = rows
+# after that key (next page), "p" = rows before it (previous page). Listings are
+# ordered by their key DESC, so each page is an index seek instead of an OFFSET scan.
+def encode_cursor(direction, page, *key):
+    return base64.urlsafe_b64encode(json.dumps([direction, page, *key]).encode()).decode().rstrip("=")
+
+def decode_cursor(token, key_len=1):
+    try:
+        direction, page, *key = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if direction not in ("n", "p") or len(key) != key_len:
+            return None
+        if not all(isinstance(k, (int, float, str)) for k in key):  # only scalars can be bound
+            return None
+        return direction, max(1, int(page)), tuple(key)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+def seek_sql(where, table="products", key=("product_id",), desc=True, direction=None):
+    """The SELECT seek_page runs: keyset after ("n") or before ("p") a cursor key
+    (params + key + limit), or with no direction OFFSET-paged (params + limit + offset)."""
+    if direction is None:
+        where_sql = f"WHERE {where}" if where else ""
+        order_by = ", ".join(f"{k} {'DESC' if desc else 'ASC'}" for k in key)
+        return f"SELECT * FROM {table} {where_sql} ORDER BY {order_by} LIMIT ? OFFSET ?"
+    op, order = ("<", "DESC") if (direction == "n") == desc else (">", "ASC")
+    conds = ([where] if where else []) + [f"({', '.join(key)}) {op} ({', '.join('?' * len(key))})"]
+    order_by = ", ".join(f"{k} {order}" for k in key)
+    return f"SELECT * FROM {table} WHERE {' AND '.join(conds)} ORDER BY {order_by} LIMIT ?"
+
+def seek_page(where, params, cursor, page, per_page=PER_PAGE, table="products", key=("product_id",), desc=True):
+    """One page of `table` rows matching `where`, ordered by `key` DESC (ASC if not desc).
+
+    Follows `cursor` when given; otherwise falls back to OFFSET for the
+    plain ?page=N link. Returns (rows, page, next_cursor, prev_cursor).
+    """
+    db = get_db()
+    cur = decode_cursor(cursor, len(key)) if cursor else None
+    if cur:
+        direction, page, last = cur
+        rows = db.execute(seek_sql(where, table, key, desc, direction), params + last + (per_page+1,)).fetchall()
+        more = len(rows) > per_page
+        rows = rows[:per_page]
+        if direction == "n":
+            has_next, has_prev = more, page > 1
+        else:
+            rows.reverse()
+            has_next, has_prev = True, more
+    else:
+        rows = db.execute(seek_sql(where, table, key, desc), params + (per_page+1, (page-1)*per_page)).fetchall()
+        has_next, has_prev = len(rows) > per_page, page > 1
+        rows = rows[:per_page]
+    next_cursor = encode_cursor("n", page+1, *[rows[-1][k] for k in key]) if rows and has_next else None
+    prev_cursor = encode_cursor("p", page-1, *[rows[0][k] for k in key]) if rows and has_prev else None
+    return rows, page, next_cursor, prev_cursor
+
+# ---------------- SORTING / FACETS ----------------
+# Browse listings (home, category) can be sorted and filtered by price. Each
+# sort is a keyset order with an index behind it, with and without a category:
+# product_id (newest), (price, product_id) and (sold, product_id). Facet counts
+# come from one grouped pass over products -- products per (category, price
+# bucket) -- cached until the catalog changes. A price range is counted from the
+# buckets it covers, plus an index seek for any part of it between bucket edges,
+# so arbitrary ?min_price=/?max_price= never cost another pass.
+SORT_KEYS = {            # ?sort= -> (keyset columns, descending)
+    'newest': (("product_id",), True),
+    'price_asc': (("price", "product_id"), False),
+    'price_desc': (("price", "product_id"), True),
+    'bestselling': (("sold", "product_id"), True),
+}
+SORT_LABELS = {'newest': "Newest", 'price_asc': "Price: low to high", 'price_desc': "Price: high to low",
+               'bestselling': "Best selling"}
+app.add_template_global(SORT_LABELS, "sort_labels")
+
+def price_buckets():
+    """[(label, min_price, max_price)] for each price facet."""
+    edges = (None,) + PRICE_BUCKETS + (None,)
+    return [(f"Under ₹{hi}" if lo is None else f"₹{lo} and up" if hi is None else f"₹{lo} - ₹{hi}", lo, hi)
+            for lo, hi in zip(edges, edges[1:])]
+
+def listing_options(args):
+    """(sort, min_price, max_price) from request args; unknown sorts and bad prices are ignored."""
+    sort = args.get('sort') if args.get('sort') in SORT_KEYS else 'newest'
+    return sort, args.get('min_price', type=float), args.get('max_price', type=float)
+
+def price_filter(min_price, max_price):
+    conds, params = [], []
+    if min_price is not None:
+        conds.append("price >= ?"); params.append(min_price)
+    if max_price is not None:
+        conds.append("price < ?"); params.append(max_price)
+    return conds, params
+
+_facet_cache = {'version': None, 'matrix': {}}
+
+def facet_matrix():
+    """{category_id: [products per price bucket]}, one grouped pass per catalog version."""
+    version = catalog_version()
+    if _facet_cache['version'] != version:
+        _facet_cache['matrix'] = {r[0]: list(r[1:]) for r in get_db().execute(facet_sql())}
+        _facet_cache['version'] = version
+    return _facet_cache['matrix']
+
+def facet_sql():
+    """facet_matrix's grouped pass: category_id, then the count per price bucket."""
+    buckets = ", ".join(f"SUM({' AND '.join(c for c in (lo is not None and f'price >= {lo}', hi is not None and f'price < {hi}') if c)})"
+                        for _, lo, hi in price_buckets())
+    # grouping by category_id alone lets the (category_id, price) index feed the
+    # aggregate in order, without a temp b-tree
+    return f"SELECT category_id, {buckets} FROM products GROUP BY category_id"
+
+def range_count_sql(min_price, max_price):
+    conds, params = price_filter(min_price, max_price)
+    return f"SELECT COUNT(*) FROM products WHERE {' AND '.join(['category_id IS ?'] + conds)}", tuple(params)
+
+def range_counts(matrix, min_price, max_price):
+    """{category_id: products in the price range}. The buckets the range covers
+    are summed from the matrix; only the slices of a range that doesn't end on
+    a bucket edge are counted, with a (category_id, price) index seek each."""
+    lo = -math.inf if min_price is None else min_price
+    hi = math.inf if max_price is None else max_price
+    edges = (-math.inf,) + PRICE_BUCKETS + (math.inf,)
+    inner_lo = min(e for e in edges if e >= lo)
+    inner_hi = max(e for e in edges if e <= hi)
+    if inner_lo >= inner_hi:
+        slices, inner = [(lo, hi)] if lo < hi else [], ()
     else:
-        user_part = f"""
-            <a class="btn btn-sm btn-outline-light me-2" href="{url_for('login')}">Login</a>
-            <a class="btn btn-sm btn-outline-light" href="{url_for('register')}">Register</a>
-        """
+        slices = [s for s in ((lo, inner_lo), (inner_hi, hi)) if s[0] < s[1]]
+        inner = [i for i, (a, b) in enumerate(zip(edges, edges[1:])) if a >= inner_lo and b <= inner_hi]
+    counts = {cid: sum(buckets[i] for i in inner) for cid, buckets in matrix.items()}
+    db = get_db()
+    for a, b in slices:
+        sql, params = range_count_sql(None if a == -math.inf else a, None if b == math.inf else b)
+        for cid in counts:
+            counts[cid] += db.execute(sql, (cid,) + params).fetchone()[0]
+    return counts
+
+def listing_facets(category_id, min_price, max_price):
+    """Facet counts for a browse listing: per category (within the price range),
+    per price bucket (within the category, ignoring the price range), and the
+    listing's own total."""
+    matrix = facet_matrix()
+    in_range = range_counts(matrix, min_price, max_price)
+    buckets, total = [0] * (len(PRICE_BUCKETS) + 1), 0
+    for cid, counts in matrix.items():
+        if category_id is None or cid == category_id:
+            buckets = [a + b for a, b in zip(buckets, counts)]
+            total += in_range[cid]
+    return {'total': total,
+            'categories': [{'category_id': c['category_id'], 'name': c['name'], 'count': in_range.get(c['category_id'], 0)}
+                           for c in nav_data()['cats']],
+            'prices': [{'label': label, 'min_price': lo, 'max_price': hi, 'count': n}
+                       for (label, lo, hi), n in zip(price_buckets(), buckets)]}
+
+def browse_where(category_id, min_price, max_price):
+    """(where, params) for seek_page over one category's (or all) products in a price range."""
+    conds, params = price_filter(min_price, max_price)
+    if category_id is not None:
+        conds.insert(0, "category_id=?"); params.insert(0, category_id)
+    return " AND ".join(conds) or None, tuple(params)
+
+def browse_listing(category_id, page, cursor, sort, min_price, max_price):
+    """A sorted, price-filtered page of products (all, or one category's) with its facets."""
+    key, desc = SORT_KEYS[sort]
+    products, page, next_cur, prev_cur = seek_page(*browse_where(category_id, min_price, max_price), cursor, page, key=key, desc=desc)
+    facets = listing_facets(category_id, min_price, max_price)
+    total = facets['total']
+    return {'products': products, 'total': total, 'page': page, 'total_pages': max(1, (total + PER_PAGE -1)//PER_PAGE),
+            'next_cursor': next_cur, 'prev_cursor': prev_cur, 'sort': sort, 'facets': facets}
+
+# ---------------- SEARCH ----------------
+# FTS5 index over products(name, description). Triggers keep it in sync on every
+# product insert/update/delete, whoever does the write.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(name, description, content='products', content_rowid='product_id');
+CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+  INSERT INTO products_fts(rowid, name, description) VALUES (new.product_id, new.name, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+  INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.product_id, old.name, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+  INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.product_id, old.name, old.description);
+  INSERT INTO products_fts(rowid, name, description) VALUES (new.product_id, new.name, new.description);
+END;
+"""
+
+def init_search(db):
+    """Create the search index if missing; an older db gets it built from existing products."""
+    exists = db.execute("SELECT 1 FROM sqlite_master WHERE name='products_fts'").fetchone()
+    run_script(db, SEARCH_SCHEMA)
+    if not exists:
+        db.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+def fts_query(q):
+    # every word must match, as a prefix ("lap" finds "laptop"); quoted so user input is never FTS syntax
+    return " ".join(f'"{t}"*' for t in re.findall(r"\w+", q))
+
+SEARCH_COUNT_SQL = "SELECT COUNT(*) FROM products_fts WHERE products_fts MATCH ?"
+SEARCH_SQL = ("SELECT p.* FROM products_fts JOIN products p ON p.product_id=products_fts.rowid "
+              "WHERE products_fts MATCH ? ORDER BY bm25(products_fts, 10.0, 1.0), p.product_id DESC")
+
+def search_products(q, page, per_page=PER_PAGE):
+    """Relevance-ranked search (name hits weigh more than description). Returns (total, rows)."""
+    match = fts_query(q)
+    if not match:
+        return 0, []
+    total = cached_count(SEARCH_COUNT_SQL, (match,))
+    rows = paginate(SEARCH_SQL, (match,), page, per_page)
+    return total, rows
+
+# ---------------- NAV CACHE ----------------
+# Category list and the rendered dropdown, shared by every page. The categories
+# version is checked against catalog_meta whenever the request has already read
+# it (every catalog page does, for its ETag and page cache), so a page never
+# pairs a fresh ETag with a stale header. Other pages re-check at most every
+# NAV_CHECK_SECONDS and build the header without touching the db. Imports
+# running in this process call invalidate_nav().
+_nav = {'version': None, 'checked': 0.0, 'cats': [], 'dropdown_html': ''}
+
+def invalidate_nav():
+    _nav['checked'] = 0.0
+
+def nav_data():
+    global _nav
+    now = time.monotonic()
+    if 'catalog_meta' not in g and now - _nav['checked'] < NAV_CHECK_SECONDS:
+        return _nav
+    try:
+        version = catalog_version('categories')
+        if version == _nav['version']:
+            _nav['checked'] = now
+            return _nav
+        cats = [dict(c) for c in get_db().execute("SELECT * FROM categories ORDER BY name").fetchall()]
+    except sqlite3.OperationalError:
+        return _nav
+    dropdown_html = Markup("".join([f'<li><a class="dropdown-item" href="{url_for("category", id=c["category_id"])}">{escape(c["name"])}</a></li>' for c in cats]))
+    # swap in a new dict so concurrent readers never see a half-built entry
+    _nav = {'version': version, 'checked': now, 'cats': cats, 'dropdown_html': dropdown_html}
+    return _nav
+
+# ---------------- AUTOCOMPLETE ----------------
+# Search-as-you-type is answered from memory: every word of every product name
+# maps to its products, best first (most units sold, then newest). The sorted
+# word list turns a prefix into a range of words by bisection, and the widest
+# ranges (prefixes up to TOP_PREFIX_LEN characters) have their top products
+# precomputed. Product edits reach the index through catalog_changes; sales
+# ranks are refreshed by a background rebuild every AUTOCOMPLETE_RERANK_SECONDS.
+# Edits happen under _autocomplete_lock but searches don't take it, so lookups
+# tolerate words and products that vanish halfway through.
+def name_words(name):
+    return set(re.findall(r"\w+", name.lower()))
+
+class PrefixIndex:
+    TOP_PREFIX_LEN = 3
+    RANK_LIMIT = 50000  # ranks of the leading word examined for a multi-word query
+    SCAN_LIMIT = 2000   # names checked against the query's other words, when those span too many words
+    MATCH_LISTS = 8     # ... i.e. more than this; narrower ones are intersected with the postings
+    CHUNK = 256         # leading-word ranks intersected at a time
+
+    def __init__(self, rows, limit=AUTOCOMPLETE_MAX_LIMIT):
+        """rows are (product_id, name, units sold)."""
+        self.limit = limit
+        self.names = {}     # product_id -> name
+        self.scores = {}    # product_id -> rank, lower is better
+        self.postings = {}  # word -> ranks of its products, sorted
+        for pid, name, units in rows:
+            score = self._score(pid, units)
+            self.names[pid], self.scores[pid] = name, score
+            for w in name_words(name):
+                self.postings.setdefault(w, []).append(score)
+        for ranks in self.postings.values():
+            ranks.sort()
+        self.words = sorted(self.postings)
+        self.top = {}
+        for w in self.words:
+            best = self.postings[w][:limit]
+            for n in range(1, min(len(w), self.TOP_PREFIX_LEN) + 1):
+                self.top.setdefault(w[:n], []).extend(best)
+        for prefix, ranks in self.top.items():
+            self.top[prefix] = sorted(set(ranks))[:limit]
+
+    @staticmethod
+    def _score(pid, units):
+        return -((units << 32) | pid)
+
+    @staticmethod
+    def _pid(score):
+        return -score & 0xFFFFFFFF
+
+    def _best(self, prefix):
+        """Top `limit` ranks among words starting with prefix."""
+        if len(prefix) <= self.TOP_PREFIX_LEN:
+            return self.top.get(prefix, [])
+        return self._refill(prefix)
+
+    def _word_range(self, prefix):
+        """(lo, hi) slice of self.words starting with prefix."""
+        lo = bisect.bisect_left(self.words, prefix)
+        return lo, bisect.bisect_left(self.words, prefix + "\uffff", lo)
+
+    def _postings_in(self, prefix, most=None):
+        """Postings lists of every word starting with prefix (None if that's more than `most` words)."""
+        lo, hi = self._word_range(prefix)
+        if most is not None and hi - lo > most:
+            return None
+        return [self.postings.get(w, ()) for w in self.words[lo:hi]]
+
+    def _ranked(self, prefix):
+        """Ranks of every product with a word starting with prefix, best first (may repeat)."""
+        best = self._best(prefix)
+        if len(best) < self.limit:
+            return iter(best)  # the whole range fits in its top
+        lists = self._postings_in(prefix)
+        return iter(lists[0]) if len(lists) == 1 else heapq.merge(*lists)
+
+    def search(self, q, limit=AUTOCOMPLETE_LIMIT):
+        """[(product_id, name)] for names with a word starting with each word of q, best first."""
+        tokens = re.findall(r"\w+", q.lower())
+        if not tokens:
+            return []
+        limit = min(limit, self.limit)
+        names = self.names
+        if len(tokens) == 1:
+            found = ((self._pid(s), names.get(self._pid(s))) for s in self._best(tokens[0])[:limit])
+            return [(pid, name) for pid, name in found if name is not None]
+        # rank by the most specific word (longest, then spanning the fewest words)
+        # and intersect it, a chunk of ranks at a time, with the postings of each
+        # other word; a word spanning too many words is matched against the names
+        spans = {t: self._word_range(t) for t in tokens}
+        lead = min(tokens, key=lambda t: (-len(t), spans[t][1] - spans[t][0]))
+        lists, patterns = [], []
+        for t in tokens:
+            if t is not lead:
+                in_range = self._postings_in(t, self.MATCH_LISTS)
+                if in_range is None:
+                    patterns.append(r"(?=.*\b" + re.escape(t) + ")")
+                else:
+                    lists.append(in_range)
+        rest = re.compile("".join(patterns), re.IGNORECASE | re.DOTALL).match if patterns else None
+        found, seen, checked, ranked = [], set(), 0, self._ranked(lead)
+        for _ in range(0, self.RANK_LIMIT, self.CHUNK):
+            chunk = list(itertools.islice(ranked, self.CHUNK))
+            if not chunk:
+                break
+            hits, lo, hi = set(chunk), chunk[0], chunk[-1]
+            for in_range in lists:
+                bounds = [(ranks, bisect.bisect_left(ranks, lo), bisect.bisect_right(ranks, hi)) for ranks in in_range]
+                if sum(j - i for _, i, j in bounds) <= 64 * len(hits):
+                    hits = hits.intersection(itertools.chain.from_iterable(ranks[i:j] for ranks, i, j in bounds))
+                else:  # the other word is far denser over this chunk: look each rank up instead
+                    hits = {s for s in hits if any(ranks[k:k + 1] == [s] for ranks, i, j in bounds
+                                                   for k in (bisect.bisect_left(ranks, s, i, j),))}
+            for score in sorted(hits):
+                pid = self._pid(score)
+                name = names.get(pid)
+                if name is None or pid in seen:
+                    continue
+                if rest:
+                    if checked == self.SCAN_LIMIT:
+                        return found
+                    checked += 1
+                    if not rest(name):
+                        continue
+                seen.add(pid)
+                found.append((pid, name))
+                if len(found) == limit:
+                    return found
+        return found
+
+    def remove(self, pid):
+        if pid not in self.names:
+            return
+        score = self.scores.pop(pid)
+        for w in name_words(self.names.pop(pid)):
+            ranks = self.postings[w]
+            del ranks[bisect.bisect_left(ranks, score)]
+            if not ranks:
+                del self.postings[w]
+                del self.words[bisect.bisect_left(self.words, w)]
+            for n in range(1, min(len(w), self.TOP_PREFIX_LEN) + 1):
+                top = self.top.get(w[:n], [])
+                if score in top:  # refill from the remaining words of that prefix
+                    self.top[w[:n]] = self._refill(w[:n])
 
-    # fetch categories for header
+    def _refill(self, prefix):
+        return sorted({s for ranks in self._postings_in(prefix) for s in ranks[:self.limit]})[:self.limit]
+
+    def add(self, pid, name, units):
+        self.remove(pid)
+        score = self._score(pid, units)
+        self.names[pid], self.scores[pid] = name, score
+        for w in name_words(name):
+            if w not in self.postings:
+                self.postings[w] = []
+                bisect.insort(self.words, w)
+            bisect.insort(self.postings[w], score)
+            for n in range(1, min(len(w), self.TOP_PREFIX_LEN) + 1):
+                top = self.top.setdefault(w[:n], [])
+                if score not in top and (len(top) < self.limit or score < top[-1]):
+                    bisect.insort(top, score)
+                    del top[self.limit:]
+
+def load_prefix_index(db):
+    """Build a PrefixIndex from db, stamped with the catalog version and change it reflects."""
+    version = db.execute("SELECT version FROM catalog_meta WHERE key='products'").fetchone()[0]
+    seen = db.execute("SELECT COALESCE(MAX(change_id), 0) FROM catalog_changes").fetchone()[0]
+    index = PrefixIndex(db.execute("SELECT product_id, name, sold FROM products"))
+    index.version, index.seen, index.built = version, seen, time.monotonic()
+    return index
+
+_autocomplete = {'index': None, 'rebuilding': False}
+_autocomplete_lock = threading.Lock()
+
+def rerank_autocomplete():
+    """Rebuild the index on its own connection and swap it in; run in a background thread."""
     try:
+        db = connect(DB, readonly=True)
+        try:
+            index = load_prefix_index(db)
+        finally:
+            db.close()
+        with _autocomplete_lock:
+            _autocomplete['index'] = index  # the next sync catches up on changes since its build
+    finally:
+        _autocomplete['rebuilding'] = False
+
+def autocomplete_index():
+    """The process's PrefixIndex, built on first use and synced with catalog changes."""
+    index = _autocomplete['index']
+    if index is not None and index.version == catalog_version():
+        if time.monotonic() - index.built > AUTOCOMPLETE_RERANK_SECONDS and not _autocomplete['rebuilding']:
+            _autocomplete['rebuilding'] = True
+            threading.Thread(target=rerank_autocomplete, daemon=True).start()
+        return index
+    with _autocomplete_lock:
+        index = _autocomplete['index']
         db = get_db()
-        cats = db.execute("SELECT * FROM categories ORDER BY name").fetchall()
-    except:
-        cats = []
-
-    cats_html = "".join([f'<a class="nav-link" href="{url_for("category", id=c["category_id"])}">{c["name"]}</a>' for c in cats])
-
-    template = f"""
-    <!doctype html>
-    <html lang="en">
-      <head>
-        <meta charset="utf-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1">
-        <title>{title}</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
-        <style>
-            body {{ background:#f5f6f8; }}
-            .card-hover:hover {{ transform: translateY(-4px); box-shadow: 0 10px 20px rgba(0,0,0,0.08); }}
-            .product-img {{ height: 180px; object-fit: cover; background: #f2f3f6; border-radius: .375rem; }}
-            header .nav-link {{ color: #222; }}
-            .search-input {{ width: 420px; max-width: 45vw; }}
-            footer {{ background:#111; color:#ddd; padding: 14px 0; margin-top: 36px; }}
-        </style>
-      </head>
-      <body>
-        <nav class="navbar navbar-expand-lg navbar-light bg-white shadow-sm">
-          <div class="container">
-            <a class="navbar-brand text-primary fw-bold" href="{url_for('index')}">LunaShop</a>
-            <form class="d-flex mx-3" action="{url_for('index')}" method="get">
-                <input class="form-control form-control-sm search-input" type="search" placeholder="Search products..." aria-label="Search" name="q" value="{request.args.get('q','')}">
-                <button class="btn btn-sm btn-primary ms-2" type="submit">Search</button>
-            </form>
-
-            <button class="navbar-toggler" type="button" data-bs-toggle="collapse" data-bs-target="#navbarsExample">
-              <span class="navbar-toggler-icon"></span>
-            </button>
-
-            <div class="collapse navbar-collapse" id="navbarsExample">
-              <ul class="navbar-nav me-auto mb-2 mb-lg-0">
-                <li class="nav-item"><a class="nav-link" href="{url_for('index')}">Home</a></li>
-                <li class="nav-item dropdown">
-                  <a class="nav-link dropdown-toggle" href="#" role="button" data-bs-toggle="dropdown">Categories</a>
-                  <ul class="dropdown-menu">
-                    {''.join([f'<li><a class="dropdown-item" href="{url_for("category", id=c["category_id"])}">{c["name"]}</a></li>' for c in cats])}
-                  </ul>
-                </li>
-                <li class="nav-item"><a class="nav-link" href="{url_for('orders')}">Orders</a></li>
+        if index is None:
+            index = _autocomplete['index'] = load_prefix_index(db)
+            return index
+        changes = db.execute("SELECT change_id, product_id FROM catalog_changes WHERE change_id > ? ORDER BY change_id",
+                             (index.seen,)).fetchall()
+        version = catalog_version()
+        if (changes and changes[0]['change_id'] > index.seen + 1) or any(c['product_id'] is None for c in changes):
+            # log pruned past what we saw, or a bulk write: start over
+            index = _autocomplete['index'] = load_prefix_index(db)
+            return index
+        for pid in {c['product_id'] for c in changes}:
+            row = db.execute("SELECT name, sold FROM products WHERE product_id=?", (pid,)).fetchone()
+            if row is None:
+                index.remove(pid)
+            elif row['name'] != index.names.get(pid):
+                index.add(pid, row['name'], row['sold'])
+        if changes:
+            index.seen = changes[-1]['change_id']
+        index.version = version
+        return index
+
+# ---------------- CART STORE ----------------
+# Carts live in the db as (cart_id, product_id) -> quantity rows; the session
+# cookie only carries cart_id. Each operation is a single keyed statement.
+CART_SCHEMA = """
+CREATE TABLE IF NOT EXISTS carts (
+    cart_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_carts_user ON carts(user_id);
+CREATE TABLE IF NOT EXISTS cart_items (
+    cart_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (cart_id, product_id),
+    FOREIGN KEY (cart_id) REFERENCES carts(cart_id),
+    FOREIGN KEY (product_id) REFERENCES products(product_id)
+) WITHOUT ROWID;
+"""
+
+def current_cart_id(create=False):
+    """Cart id from the session, creating a cart for the logged-in user if asked."""
+    cid = session.get('cart_id')
+    if cid or not create:
+        return cid
+    db = get_db(write=True)
+    cid = db.execute("INSERT INTO carts (user_id) VALUES (?)", (session.get('user_id'),)).lastrowid
+    db.commit()
+    session['cart_id'] = cid
+    return cid
+
+USER_CART_SQL = "SELECT cart_id FROM carts WHERE user_id=? ORDER BY cart_id DESC LIMIT 1"
+CART_LINES_SQL = ("SELECT p.*, ci.quantity, p.price*ci.quantity AS line_total FROM cart_items ci "
+                  "JOIN products p ON p.product_id=ci.product_id WHERE ci.cart_id=? ORDER BY ci.product_id")
+
+def user_cart_id(user_id):
+    row = get_db().execute(USER_CART_SQL, (user_id,)).fetchone()
+    return row['cart_id'] if row else None
+
+def cart_add(cid, product_id, quantity=1):
+    db = get_db(write=True)
+    db.execute("INSERT INTO cart_items (cart_id,product_id,quantity) VALUES (?,?,?) "
+               "ON CONFLICT(cart_id,product_id) DO UPDATE SET quantity=quantity+excluded.quantity", (cid, product_id, quantity))
+    db.commit()
+
+def cart_set(cid, product_id, quantity):
+    if quantity <= 0:
+        return cart_remove(cid, product_id)
+    db = get_db(write=True)
+    db.execute("UPDATE cart_items SET quantity=? WHERE cart_id=? AND product_id=?", (quantity, cid, product_id))
+    db.commit()
+
+def cart_remove(cid, product_id):
+    db = get_db(write=True)
+    db.execute("DELETE FROM cart_items WHERE cart_id=? AND product_id=?", (cid, product_id))
+    db.commit()
+
+def cart_lines(cid, db=None):
+    """Products in the cart with their quantity, and the cart total. Returns (rows, total)."""
+    if not cid:
+        return [], 0
+    rows = (db or get_db()).execute(CART_LINES_SQL, (cid,)).fetchall()
+    return rows, sum(r['line_total'] for r in rows)
+
+# ---------------- INVENTORY ----------------
+# products.stock is the number left to sell; NULL means stock isn't tracked for
+# that product. Checkout reserves stock with a conditional UPDATE inside its
+# write transaction, so two buyers can never both take the last unit. Stock
+# moves don't change any page except when a product sells out or comes back,
+# so only those flips bump the catalog version and change log.
+AVAILABLE_OLD = "(COALESCE(old.stock, 1) > 0)"
+AVAILABLE_NEW = "(COALESCE(new.stock, 1) > 0)"
+STOCK_SCHEMA = f"""
+DROP TRIGGER IF EXISTS products_version_au;
+CREATE TRIGGER products_version_au AFTER UPDATE OF name, description, price, image, category_id ON products BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='products';
+END;
+CREATE TRIGGER IF NOT EXISTS products_version_stock AFTER UPDATE OF stock ON products WHEN {AVAILABLE_OLD} != {AVAILABLE_NEW} BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='products';
+END;
+DROP TRIGGER IF EXISTS products_changes_au;
+CREATE TRIGGER products_changes_au AFTER UPDATE OF name, description, price, image, category_id ON products BEGIN
+  INSERT INTO catalog_changes (product_id, category_id) VALUES (old.product_id, old.category_id), (new.product_id, new.category_id);
+  DELETE FROM catalog_changes WHERE change_id <= (SELECT MAX(change_id) FROM catalog_changes) - 10000;
+END;
+CREATE TRIGGER IF NOT EXISTS products_changes_stock AFTER UPDATE OF stock ON products WHEN {AVAILABLE_OLD} != {AVAILABLE_NEW} BEGIN
+  INSERT INTO catalog_changes (product_id, category_id) VALUES (new.product_id, new.category_id);
+  DELETE FROM catalog_changes WHERE change_id <= (SELECT MAX(change_id) FROM catalog_changes) - 10000;
+END;
+"""
+
+def migrate_stock(db):
+    add_column(db, "products", "stock", "INTEGER")
+    run_script(db, STOCK_SCHEMA)
+
+def in_stock(p):
+    # only availability is exposed: exact counts change on every sale without
+    # bumping the catalog version, so they'd go stale in cached pages
+    return p['stock'] is None or p['stock'] > 0
+
+app.add_template_global(in_stock)
+
+def reserve_stock(db, lines):
+    """Take stock for each cart line; returns (reserved lines, lines short on stock)."""
+    reserved, short = [], []
+    for p in lines:
+        cur = db.execute("UPDATE products SET stock=stock-? WHERE product_id=? AND (stock IS NULL OR stock>=?)",
+                         (p['quantity'], p['product_id'], p['quantity']))
+        (reserved if cur.rowcount else short).append(p)
+    return reserved, short
+
+# ---------------- ORDER WRITES ----------------
+# Every checkout form carries a random token stored on the order it creates, so
+# a double-submitted or retried form finds that order instead of writing again.
+ORDER_SCHEMA = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_checkout_token ON orders(checkout_token);
+"""
+
+ORDER_TOKEN_SQL = "SELECT * FROM orders WHERE checkout_token=? AND user_id=?"
+
+def order_for_token(user_id, token, db=None):
+    return (db or get_db()).execute(ORDER_TOKEN_SQL, (token, user_id)).fetchone()
+
+def place_order(user_id, cid, token, status):
+    """Turn the cart into an order in one write transaction.
+
+    BEGIN IMMEDIATE takes the write lock up front, so the token check, the
+    stock reservation, the order + items inserts and the cart clear can't
+    interleave with another checkout. Lines short on stock are left out of
+    the order and stay in the cart. Returns (order row, short lines); the
+    order is the existing one on a retry, or None if nothing could be placed.
+    """
+    db = get_db(write=True)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        order = order_for_token(user_id, token, db)
+        short = []
+        if not order:
+            lines, _ = cart_lines(cid, db)
+            lines, short = reserve_stock(db, lines)
+            if not lines:
+                db.rollback()
+                return None, short
+            total = sum(p['line_total'] for p in lines)
+            order_id = db.execute("INSERT INTO orders (user_id,total_amount,status,checkout_token) VALUES (?,?,?,?)",
+                                  (user_id, total, status, token)).lastrowid
+            db.executemany("INSERT INTO order_items (order_id,product_id,quantity,price) VALUES (?,?,?,?)",
+                           [(order_id, p['product_id'], p['quantity'], p['price']) for p in lines])
+            db.executemany("DELETE FROM cart_items WHERE cart_id=? AND product_id=?", [(cid, p['product_id']) for p in lines])
+            order = db.execute("SELECT * FROM orders WHERE order_id=?", (order_id,)).fetchone()
+            record_sales(db, order, lines)
+        db.commit()
+        return order, short
+    except Exception:
+        db.rollback()
+        raise
+
+# ---------------- SALES AGGREGATES ----------------
+# The admin dashboard reads running totals instead of grouping over orders and
+# order_items: checkout adds each order to them in its own transaction, and
+# rebuild_sales() recomputes them from scratch (migration 9, rebuild-sales,
+# bulk loads). Products without a category are totalled under category_id 0.
+# products.sold mirrors sales_products.units so listings can sort by it.
+SALES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day TEXT PRIMARY KEY,
+    orders INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sales_products (
+    product_id INTEGER PRIMARY KEY,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sales_products_revenue ON sales_products(revenue, product_id);
+CREATE TABLE IF NOT EXISTS sales_categories (
+    category_id INTEGER PRIMARY KEY,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sales_categories_revenue ON sales_categories(revenue, category_id);
+"""
+
+def record_sales(db, order, lines):
+    """Add one placed order to the running totals (caller holds the write transaction)."""
+    db.execute("INSERT INTO sales_daily (day, orders, units, revenue) VALUES (date(?), 1, ?, ?) "
+               "ON CONFLICT(day) DO UPDATE SET orders=orders+1, units=units+excluded.units, revenue=revenue+excluded.revenue",
+               (order['created_at'], sum(p['quantity'] for p in lines), order['total_amount']))
+    db.executemany("INSERT INTO sales_products (product_id, units, revenue) VALUES (?, ?, ?) "
+                   "ON CONFLICT(product_id) DO UPDATE SET units=units+excluded.units, revenue=revenue+excluded.revenue",
+                   [(p['product_id'], p['quantity'], p['line_total']) for p in lines])
+    db.executemany("INSERT INTO sales_categories (category_id, units, revenue) VALUES (?, ?, ?) "
+                   "ON CONFLICT(category_id) DO UPDATE SET units=units+excluded.units, revenue=revenue+excluded.revenue",
+                   [(p['category_id'] or 0, p['quantity'], p['line_total']) for p in lines])
+    db.executemany("UPDATE products SET sold=sold+? WHERE product_id=?", [(p['quantity'], p['product_id']) for p in lines])
+
+def rebuild_sales(db):
+    """Recompute every running total from orders and order_items (caller commits)."""
+    db.execute("DELETE FROM sales_daily")
+    db.execute("DELETE FROM sales_products")
+    db.execute("DELETE FROM sales_categories")
+    db.execute("INSERT INTO sales_daily (day, orders, units, revenue) "
+               "SELECT date(o.created_at), COUNT(*), COALESCE(SUM(i.units), 0), COALESCE(SUM(o.total_amount), 0) FROM orders o "
+               "LEFT JOIN (SELECT order_id, SUM(quantity) AS units FROM order_items GROUP BY order_id) i ON i.order_id=o.order_id "
+               "GROUP BY date(o.created_at)")
+    db.execute("INSERT INTO sales_products (product_id, units, revenue) "
+               "SELECT product_id, SUM(quantity), SUM(quantity*price) FROM order_items GROUP BY product_id")
+    db.execute("INSERT INTO sales_categories (category_id, units, revenue) "
+               "SELECT COALESCE(p.category_id, 0), SUM(s.units), SUM(s.revenue) FROM sales_products s "
+               "LEFT JOIN products p ON p.product_id=s.product_id GROUP BY COALESCE(p.category_id, 0)")
+    db.execute("UPDATE products SET sold=0 WHERE sold != 0")
+    db.execute("UPDATE products SET sold=s.units FROM sales_products s WHERE s.product_id=products.product_id")
+
+def migrate_sales(db):
+    run_script(db, SALES_SCHEMA)  # filled by migration 9, once products.sold exists
+
+LISTING_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_products_price ON products(price, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_category_price ON products(category_id, price, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_sold ON products(sold, product_id);
+CREATE INDEX IF NOT EXISTS idx_products_category_sold ON products(category_id, sold, product_id);
+"""
+
+def migrate_listing_sorts(db):
+    add_column(db, "products", "sold", "INTEGER NOT NULL DEFAULT 0")
+    run_script(db, LISTING_SCHEMA)
+    rebuild_sales(db)
+
+# ---------------- CONDITIONAL GET ----------------
+# Catalog pages change only when products or categories do, so their validators
+# come straight from catalog_meta and a revalidation is answered with 304
+# before the view runs any query or renders. The header shows who is logged
+# in, so the ETag includes the session user; Last-Modified (and so
+# If-Modified-Since) is only used for anonymous pages, which are all alike.
+def conditional_get(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # best-selling order moves with every sale, which doesn't bump the catalog version
+        if request.method != 'GET' or request.args.get('q') or request.args.get('sort') == 'bestselling':
+            return view(*args, **kwargs)
+        products, categories = catalog_stamp('products'), catalog_stamp('categories')
+        user = session.get('user_id')
+        variant = f"user:{user}:{session.get('username')}" if user else "anon"
+        etag = hashlib.sha1(f"{products[0]}:{categories[0]}:{variant}".encode()).hexdigest()
+        last_modified = None if user else datetime.fromtimestamp(max(products[1], categories[1]), timezone.utc)
+
+        if request.if_none_match:
+            fresh = request.if_none_match.contains_weak(etag)  # gzipped copies carry it as W/"..."
+        else:
+            fresh = bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+        resp = app.response_class(status=304) if fresh else app.make_response(view(*args, **kwargs))
+        if resp.status_code in (200, 304):
+            resp.set_etag(etag)
+            if last_modified:
+                resp.last_modified = last_modified
+            resp.cache_control.no_cache = True
+            resp.cache_control.private = bool(user)
+            resp.vary.add('Cookie')
+        return resp
+    return wrapper
+
+# ---------------- PAGE CACHE ----------------
+# Rendered catalog pages for anonymous visitors, kept in memory under a byte
+# budget with LRU eviction and a TTL. Each page is tagged with what it shows
+# (product:<id>, category:<id>, home, search). Product triggers log changed
+# product/category ids in catalog_changes; when the products version moves,
+# only the pages tagged with those ids (plus home and search listings) are
+# dropped. A categories change alters the nav on every page and clears it all,
+# as does a NULL product_id row, which bulk writers log instead of one per row.
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog_changes (change_id INTEGER PRIMARY KEY AUTOINCREMENT, product_id INTEGER, category_id INTEGER);
+""" + "".join(f"""
+CREATE TRIGGER IF NOT EXISTS products_changes_{suffix} AFTER {op} ON products BEGIN
+  INSERT INTO catalog_changes (product_id, category_id) VALUES {rows};
+  DELETE FROM catalog_changes WHERE change_id <= (SELECT MAX(change_id) FROM catalog_changes) - 10000;
+END;""" for suffix, op, rows in (('ai', 'INSERT', "(new.product_id, new.category_id)"),
+                                  ('au', 'UPDATE', "(old.product_id, old.category_id), (new.product_id, new.category_id)"),
+                                  ('ad', 'DELETE', "(old.product_id, old.category_id)")))
+
+class PageCache:
+    """LRU of rendered pages bounded by total body size, with a TTL and tag eviction."""
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes, self.ttl = max_bytes, ttl
+        self._entries = OrderedDict()   # key -> (expires, body, mimetype, tags)
+        self._tags = {}                 # tag -> set of keys
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self.generation = 0             # bumped on every invalidation
+        self.seen = None                # (products version, categories version, last change_id)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry:
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def set(self, key, body, mimetype, tags, generation):
+        with self._lock:
+            if generation != self.generation or len(body) > self.max_bytes:
+                return  # rendered from data that was invalidated meanwhile
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, body, mimetype, tags)
+            self.size += len(body)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self.size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def evict_tags(self, tags):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+            self.size = 0
+
+    def _drop(self, key):
+        _, body, _, tags = self._entries.pop(key)
+        self.size -= len(body)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'bytes': self.size, 'max_bytes': self.max_bytes}
+
+page_cache = PageCache(PAGE_CACHE_BYTES, PAGE_CACHE_TTL)
+
+def sync_page_cache():
+    """Evict pages touched by catalog writes since the last check (one read when nothing changed)."""
+    products, categories = catalog_version('products'), catalog_version('categories')
+    seen = page_cache.seen
+    if seen and seen[:2] == (products, categories):
+        return
+    db = get_db()
+    if not seen or seen[1] != categories:
+        last = db.execute("SELECT COALESCE(MAX(change_id), 0) FROM catalog_changes").fetchone()[0]
+        page_cache.clear()
+    else:
+        changes = db.execute("SELECT change_id, product_id, category_id FROM catalog_changes WHERE change_id > ? ORDER BY change_id", (seen[2],)).fetchall()
+        last = changes[-1]['change_id'] if changes else seen[2]
+        if changes and changes[0]['change_id'] > seen[2] + 1 and seen[2]:
+            page_cache.clear()  # log was pruned past what we saw
+        elif any(c['product_id'] is None for c in changes):
+            page_cache.clear()  # bulk write (catalog import) logged as "everything"
+        else:
+            tags = {'home', 'search'}
+            for c in changes:
+                tags.update((f"product:{c['product_id']}", f"category:{c['category_id']}"))
+            page_cache.evict_tags(tags)
+    page_cache.seen = (products, categories, last)
+
+def cache_when_sent(chunks, key, mimetype, tags, generation):
+    """Pass a streamed page through, caching it once the last chunk is out."""
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    page_cache.set(key, b"".join(body), mimetype, tags, generation)
+
+def tag_page(*tags):
+    """Add tags to the page being rendered, for what a view only knows it shows once it has run."""
+    g.setdefault('page_tags', set()).update(tags)
+
+def cached_page(tags):
+    """Serve anonymous GETs of the view from page_cache; `tags(**view_args)`, plus
+    any tag_page() calls the view makes, name what the page shows."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or session.get('user_id'):
+                return view(*args, **kwargs)
+            sync_page_cache()
+            key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))))
+            hit = page_cache.get(key)
+            if hit:
+                resp = app.response_class(hit[1], mimetype=hit[2])
+                resp.headers['X-Cache'] = 'HIT'
+                return resp
+            generation = page_cache.generation
+            resp = app.make_response(view(*args, **kwargs))
+            page_tags = tags(**kwargs) | g.pop('page_tags', set())
+            if resp.status_code == 200 and resp.is_streamed:
+                resp.response = cache_when_sent(resp.iter_encoded(), key, resp.mimetype, page_tags, generation)
+            elif resp.status_code == 200:
+                page_cache.set(key, resp.get_data(), resp.mimetype, page_tags, generation)
+            resp.headers['X-Cache'] = 'MISS'
+            return resp
+        return wrapper
+    return decorator
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(dict(page_cache.stats(), pid=os.getpid()))  # this worker's cache only
+
+# ---------------- IMAGES ----------------
+# Product images are served as resized JPEG/WebP variants instead of the full
+# upload. URLs carry a hash of the source file (/img/<size>/<hash>/<image>.<fmt>),
+# so variants are cached forever by browsers and regenerated under a new URL
+# when the source changes. Variants are made on first request (or up front
+# with `flask build-images`) and kept in IMAGE_CACHE_DIR.
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # no Pillow: pages fall back to the original files
+    Image = None
+
+IMAGE_DIR = os.path.join(app.root_path, 'static', 'images')
+IMAGE_CACHE_DIR = os.path.join(app.root_path, 'image_cache')
+IMAGE_SIZES = {            # name -> (width, height, crop to fill?)
+    'thumb': (160, 160, True),
+    'card': (480, 360, True),
+    'detail': (1000, 1000, False),
+}
+IMAGE_FORMATS = {'jpeg': ('JPEG', 'image/jpeg'), 'webp': ('WEBP', 'image/webp')}
+_image_hashes = {}   # image -> (mtime_ns, size, hash)
+
+def image_hash(image):
+    """Short content hash of a source image, recomputed only when the file changes."""
+    path = safe_join(IMAGE_DIR, image)
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    known = _image_hashes.get(image)
+    if known and known[:2] == (st.st_mtime_ns, st.st_size):
+        return known[2]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+    _image_hashes[image] = (st.st_mtime_ns, st.st_size, digest)
+    return digest
+
+def image_url(image, size, fmt='jpeg'):
+    digest = image_hash(image) if Image else None
+    if not digest:
+        return f"/static/images/{image}"
+    return url_for('product_image', size=size, digest=digest, filename=f"{image}.{fmt}")
+
+app.add_template_global(image_url)
+
+def build_variant(image, size, fmt, digest):
+    """Path of the cached variant, rendering it first if needed."""
+    out = os.path.join(IMAGE_CACHE_DIR, size, f"{digest}-{hashlib.sha1(image.encode()).hexdigest()[:8]}.{fmt}")
+    if os.path.exists(out):
+        return out
+    width, height, crop = IMAGE_SIZES[size]
+    with Image.open(safe_join(IMAGE_DIR, image)) as src:
+        img = ImageOps.exif_transpose(src).convert('RGB')
+    if crop:
+        img = ImageOps.fit(img, (width, height), Image.LANCZOS)
+    else:
+        img.thumbnail((width, height), Image.LANCZOS)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    tmp = f"{out}.{os.getpid()}.{threading.get_ident()}.tmp"
+    img.save(tmp, IMAGE_FORMATS[fmt][0], quality=82, optimize=True)
+    os.replace(tmp, out)   # atomic, so concurrent requests never see half a file
+    return out
+
+@app.route('/img/<size>/<digest>/<path:filename>')
+def product_image(size, digest, filename):
+    image, _, fmt = filename.rpartition('.')
+    if Image is None or size not in IMAGE_SIZES or fmt not in IMAGE_FORMATS or not image:
+        abort(404)
+    current = image_hash(image)
+    if current is None:
+        abort(404)
+    if current != digest:
+        return redirect(url_for('product_image', size=size, digest=current, filename=filename))
+    resp = send_file(build_variant(image, size, fmt, digest), mimetype=IMAGE_FORMATS[fmt][1], max_age=31536000)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+@app.cli.command("build-images")
+def build_images_command():
+    """Pre-render every size/format variant of each product image."""
+    db = connect(DB)
+    made = 0
+    for (image,) in db.execute("SELECT DISTINCT image FROM products WHERE image IS NOT NULL AND image != ''"):
+        digest = image_hash(image)
+        if not digest:
+            click.echo(f"missing: {image}")
+            continue
+        for size in IMAGE_SIZES:
+            for fmt in IMAGE_FORMATS:
+                build_variant(image, size, fmt, digest)
+                made += 1
+    db.close()
+    click.echo(f"{made} variants in {IMAGE_CACHE_DIR}")
+
+# ---------------- RECOMMENDATIONS ----------------
+# "Frequently bought together" is precomputed by `flask build-recommendations`:
+# it folds orders placed since its last run (batch_jobs.last_id) into pair
+# counts, RECOMMEND_BATCH orders at a time, so memory is bounded by the batch
+# (baskets are capped at MAX_BASKET items). Only the CO_PURCHASE_KEEP strongest
+# pairs per product are kept, so counts for weak pairs are approximate but the
+# table stays O(products). The product page reads its top RELATED_PRODUCTS
+# with one seek on the (product_id, orders) index.
+RECOMMEND_SCHEMA = """
+CREATE TABLE IF NOT EXISTS co_purchases (
+    product_id INTEGER NOT NULL,
+    related_id INTEGER NOT NULL,
+    orders INTEGER NOT NULL,
+    PRIMARY KEY (product_id, related_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_co_purchases_top ON co_purchases(product_id, orders, related_id);
+CREATE TABLE IF NOT EXISTS batch_jobs (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL DEFAULT 0);
+"""
+CO_PURCHASE_KEEP = 50
+MAX_BASKET = 30
+
+RELATED_SQL = ("SELECT p.* FROM co_purchases c JOIN products p ON p.product_id=c.related_id "
+               "WHERE c.product_id=? ORDER BY c.orders DESC, c.related_id DESC LIMIT ?")
+
+def related_products(product_id, limit=RELATED_PRODUCTS):
+    return get_db().execute(RELATED_SQL, (product_id, limit)).fetchall()
+
+def co_purchase_pairs(db, first, last):
+    """Counter of (product, related) pairs over the baskets of orders first..last."""
+    pairs = Counter()
+    rows = db.execute("SELECT order_id, product_id FROM order_items WHERE order_id BETWEEN ? AND ? ORDER BY order_id",
+                      (first, last))
+    for _, items in itertools.groupby(rows, key=lambda r: r[0]):
+        basket = sorted({r[1] for r in items})[:MAX_BASKET]
+        for a, b in itertools.combinations(basket, 2):
+            pairs[a, b] += 1
+            pairs[b, a] += 1
+    return pairs
+
+def build_recommendations(db, full=False, batch_size=RECOMMEND_BATCH, echo=None):
+    """Fold orders placed since the last run into co_purchases; returns how many were read."""
+    if full:
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("DELETE FROM co_purchases")
+        db.execute("DELETE FROM batch_jobs WHERE name='recommendations'")
+        db.commit()
+    row = db.execute("SELECT last_id FROM batch_jobs WHERE name='recommendations'").fetchone()
+    last = row[0] if row else 0
+    done, touched = 0, set()
+    while True:
+        ids = [r[0] for r in db.execute("SELECT order_id FROM orders WHERE order_id > ? ORDER BY order_id LIMIT ?",
+                                        (last, batch_size))]
+        if not ids:
+            break
+        pairs = co_purchase_pairs(db, ids[0], ids[-1])  # placed orders never change, so read before locking
+        products = {a for a, _ in pairs}
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("INSERT INTO co_purchases (product_id, related_id, orders) VALUES (?, ?, ?) "
+                           "ON CONFLICT(product_id, related_id) DO UPDATE SET orders=orders+excluded.orders",
+                           [(a, b, n) for (a, b), n in pairs.items()])
+            db.executemany("DELETE FROM co_purchases WHERE product_id=? AND related_id NOT IN "
+                           "(SELECT related_id FROM co_purchases WHERE product_id=? ORDER BY orders DESC, related_id DESC LIMIT ?)",
+                           [(pid, pid, CO_PURCHASE_KEEP) for pid in products])
+            db.execute("INSERT INTO batch_jobs (name, last_id) VALUES ('recommendations', ?) "
+                       "ON CONFLICT(name) DO UPDATE SET last_id=excluded.last_id", (ids[-1],))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        last, done = ids[-1], done + len(ids)
+        touched |= products
+        if echo: echo(f"  {done} orders")
+    if touched:
+        # product pages show recommendations: refresh their validators and cached copies
+        db.execute("BEGIN IMMEDIATE")
+        db.execute("UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='products'")
+        if len(touched) > CO_PURCHASE_KEEP * 100:
+            db.execute("INSERT INTO catalog_changes (product_id, category_id) VALUES (NULL, NULL)")
+        else:
+            db.executemany("INSERT INTO catalog_changes (product_id, category_id) SELECT product_id, category_id FROM products "
+                           "WHERE product_id=?", [(pid,) for pid in touched])
+        db.commit()
+    return done
+
+@app.cli.command("build-recommendations")
+@click.option("--full", is_flag=True, help="Start over from the first order.")
+@click.option("--batch-size", default=RECOMMEND_BATCH, show_default=True, help="Orders per transaction.")
+def build_recommendations_command(full, batch_size):
+    """Fold new orders into the "frequently bought together" table."""
+    db = connect(DB)
+    migrate(db)
+    click.echo(f"processed {build_recommendations(db, full, batch_size, echo=click.echo)} orders")
+    db.close()
+
+# ---------------- TEMPLATES ----------------
+# All pages are Jinja templates served from this dict. They are compiled once at
+# import (warm_templates) and cached by the environment, so a request only pays
+# for rendering its context; user data is autoescaped, never parsed as template code.
+TEMPLATES = {
+'layout.html': """<!doctype html>
+<html lang="en">
+  <head>
+    <meta charset="utf-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1">
+    <title>{{ title }}</title>
+    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css" rel="stylesheet">
+    <style>
+        body { background:#f5f6f8; }
+        .card-hover:hover { transform: translateY(-4px); box-shadow: 0 10px 20px rgba(0,0,0,0.08); }
+        .product-img { height: 180px; object-fit: cover; background: #f2f3f6; border-radius: .375rem; }
+        header .nav-link { color: #222; }
+        .search-input { width: 420px; max-width: 45vw; }
+        footer { background:#111; color:#ddd; padding: 14px 0; margin-top: 36px; }
+    </style>
+  </head>
+  <body>
+    <nav class="navbar navbar-expand-lg navbar-light bg-white shadow-sm">
+      <div class="container">
+        <a class="navbar-brand text-primary fw-bold" href="{{ url_for('index') }}">LunaShop</a>
+        <form class="d-flex mx-3" action="{{ url_for('index') }}" method="get">
+            <input class="form-control form-control-sm search-input" type="search" placeholder="Search products..." aria-label="Search" name="q" value="{{ request.args.get('q','') }}"
+                   list="search-suggest" autocomplete="off" data-suggest="{{ url_for('api_autocomplete') }}">
+            <datalist id="search-suggest"></datalist>
+            <button class="btn btn-sm btn-primary ms-2" type="submit">Search</button>
+        </form>
+
+        <button class="navbar-toggler" type="button" data-bs-toggle="collapse" data-bs-target="#navbarsExample">
+          <span class="navbar-toggler-icon"></span>
+        </button>
+
+        <div class="collapse navbar-collapse" id="navbarsExample">
+          <ul class="navbar-nav me-auto mb-2 mb-lg-0">
+            <li class="nav-item"><a class="nav-link" href="{{ url_for('index') }}">Home</a></li>
+            <li class="nav-item dropdown">
+              <a class="nav-link dropdown-toggle" href="#" role="button" data-bs-toggle="dropdown">Categories</a>
+              <ul class="dropdown-menu">
+                {{ nav.dropdown_html }}
               </ul>
+            </li>
+            <li class="nav-item"><a class="nav-link" href="{{ url_for('orders') }}">Orders</a></li>
+            {% if session.get('is_admin') %}<li class="nav-item"><a class="nav-link" href="{{ url_for('admin') }}">Dashboard</a></li>{% endif %}
+          </ul>
+
+          <div class="d-flex align-items-center">
+            {% if session.get('user_id') %}
+            <span class="me-3">Hello, <strong>{{ session.get('username') }}</strong></span>
+            <a class="btn btn-sm btn-outline-light me-2" href="{{ url_for('cart') }}">🛒 Cart</a>
+            <a class="btn btn-sm btn-outline-light" href="{{ url_for('logout') }}">Logout</a>
+            {% else %}
+            <a class="btn btn-sm btn-outline-light me-2" href="{{ url_for('login') }}">Login</a>
+            <a class="btn btn-sm btn-outline-light" href="{{ url_for('register') }}">Register</a>
+            {% endif %}
+          </div>
+        </div>
+      </div>
+    </nav>
+
+    <main class="container mt-4">
+        {% block content %}{% endblock %}
+    </main>
 
-              <div class="d-flex align-items-center">
-                {user_part}
-              </div>
+    <footer class="text-center">
+      <div class="container">
+        <small>© 2025 LunaShop — College Project</small>
+      </div>
+    </footer>
+
+    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js"></script>
+    <script>
+      // search-as-you-type suggestions from /api/autocomplete
+      (function(){
+        var input=document.querySelector('[data-suggest]'), list=document.getElementById('search-suggest'), timer;
+        input.addEventListener('input', function(){
+          clearTimeout(timer);
+          timer=setTimeout(function(){
+            if(!input.value.trim()){ list.innerHTML=''; return; }
+            fetch(input.dataset.suggest+'?q='+encodeURIComponent(input.value)).then(function(r){ return r.json(); }).then(function(d){
+              list.innerHTML='';
+              d.results.forEach(function(p){ var o=document.createElement('option'); o.value=p.name; list.appendChild(o); });
+            });
+          }, 100);
+        });
+      })();
+    </script>
+  </body>
+</html>
+""",
+
+'macros.html': """
+{% macro pagination(page, total_pages, prev_url, next_url) %}
+  <nav aria-label="page-nav">
+    <ul class="pagination">
+      <li class="page-item {{ 'disabled' if not prev_url }}">
+        <a class="page-link" href="{{ prev_url or '#' }}">Previous</a>
+      </li>
+      <li class="page-item disabled"><span class="page-link">Page {{ page }}{% if total_pages %}/{{ total_pages }}{% endif %}</span></li>
+      <li class="page-item {{ 'disabled' if not next_url }}">
+        <a class="page-link" href="{{ next_url or '#' }}">Next</a>
+      </li>
+    </ul>
+  </nav>
+{% endmacro %}
+
+{% macro listing_controls(endpoint, base, opts, facets, show_categories) %}
+  <form class="row g-2 align-items-end mb-2" method="get" action="{{ url_for(endpoint, **base) }}">
+    <div class="col-auto"><select name="sort" class="form-select form-select-sm" onchange="this.form.submit()">
+      {% for key, label in sort_labels.items() %}<option value="{{ key }}" {{ 'selected' if opts.get('sort', 'newest') == key }}>{{ label }}</option>{% endfor %}
+    </select></div>
+    <div class="col-auto"><input name="min_price" type="number" step="any" min="0" class="form-control form-control-sm" placeholder="Min ₹" value="{{ opts.get('min_price', '') }}"></div>
+    <div class="col-auto"><input name="max_price" type="number" step="any" min="0" class="form-control form-control-sm" placeholder="Max ₹" value="{{ opts.get('max_price', '') }}"></div>
+    <div class="col-auto"><button class="btn btn-sm btn-outline-primary">Apply</button></div>
+  </form>
+  <div class="small mb-3">
+    {% for b in facets.prices %}{% if b.count %}<a class="me-3" href="{{ url_for(endpoint, sort=opts.get('sort'), min_price=b.min_price, max_price=b.max_price, **base) }}">{{ b.label }} ({{ b.count }})</a>{% endif %}{% endfor %}
+    {% if show_categories %}<br>{% for c in facets.categories %}{% if c.count %}<a class="me-3" href="{{ url_for('category', id=c.category_id, **opts) }}">{{ c.name }} ({{ c.count }})</a>{% endif %}{% endfor %}{% endif %}
+  </div>
+{% endmacro %}
+""",
+
+'message.html': """{% extends "layout.html" %}
+{% block content %}<h3>{{ message }}</h3>{% endblock %}
+""",
+
+'register.html': """{% extends "layout.html" %}
+{% block content %}
+  <div class="row justify-content-center">
+    <div class="col-md-6">
+      <div class="card p-4">
+        <h4>Register</h4>
+        <form method="post">
+          <div class="mb-2">
+            <label class="form-label">Username</label>
+            <input class="form-control" name="username" required>
+          </div>
+          <div class="mb-2">
+            <label class="form-label">Email</label>
+            <input class="form-control" type="email" name="email" required>
+          </div>
+          <div class="mb-3">
+            <label class="form-label">Password</label>
+            <input class="form-control" type="password" name="password" required>
+          </div>
+          <button class="btn btn-primary">Create account</button>
+        </form>
+      </div>
+    </div>
+  </div>
+{% endblock %}
+""",
+
+'login.html': """{% extends "layout.html" %}
+{% block content %}
+  <div class="row justify-content-center">
+    <div class="col-md-5">
+      <div class="card p-4">
+        <h4>Login</h4>
+        <form method="post">
+          <div class="mb-2">
+            <label class="form-label">Email</label>
+            <input class="form-control" name="email" type="email" required>
+          </div>
+          <div class="mb-3">
+            <label class="form-label">Password</label>
+            <input class="form-control" name="password" type="password" required>
+          </div>
+          <button class="btn btn-primary">Login</button>
+        </form>
+      </div>
+    </div>
+  </div>
+{% endblock %}
+""",
+
+'index.html': """{% extends "layout.html" %}
+{% from "macros.html" import pagination, listing_controls %}
+{% block content %}
+  <div class="mb-3">
+    <h2>{{ heading }}</h2>
+  </div>
+  {% if facets %}{{ listing_controls('index', {}, opts, facets, True) }}{% endif %}
+  <div class="row g-3">
+    {% for p in products %}
+    <div class="col-md-3">
+      <div class="card card-hover p-3">
+        {% if p.image %}<picture>
+          <source type="image/webp" srcset="{{ image_url(p.image, 'card', 'webp') }}">
+          <img src="{{ image_url(p.image, 'card') }}" class="product-img w-100 mb-2" alt="{{ p.name }}" loading="lazy" width="480" height="360">
+        </picture>{% endif %}
+        <h6><a href="{{ url_for('product', id=p.product_id) }}" class="text-decoration-none">{{ p.name }}</a></h6>
+        <p class="text-muted small">{{ (p.description or '')[:90] }}</p>
+        <div class="d-flex justify-content-between align-items-center mt-2">
+            <div class="fw-bold text-primary">₹{{ '%.2f'|format(p.price) }}</div>
+            <div>
+                <a href="{{ url_for('product', id=p.product_id) }}" class="btn btn-sm btn-outline-secondary me-1">View</a>
+                <a href="{{ url_for('add_to_cart', id=p.product_id) }}" class="btn btn-sm btn-success">Add to Cart</a>
+            </div>
+        </div>
+      </div>
+    </div>
+    {% else %}
+    <div class="col-12"><div class="alert alert-light">No products found.</div></div>
+    {% endfor %}
+  </div>
+  <div class="mt-4">{{ pagination(page, total_pages, prev_url, next_url) }}</div>
+{% endblock %}
+""",
+
+'category.html': """{% extends "layout.html" %}
+{% from "macros.html" import pagination, listing_controls %}
+{% block content %}
+  <h2>Category: {{ cat.name }}</h2>
+  {{ listing_controls('category', {'id': cat.category_id}, opts, facets, False) }}
+  <div class="row g-3">
+    {% for p in products %}
+    <div class="col-md-3">
+      <div class="card p-3 card-hover">
+        <h6><a href="{{ url_for('product', id=p.product_id) }}">{{ p.name }}</a></h6>
+        <p class="text-muted small">{{ (p.description or '')[:80] }}</p>
+        <div class="d-flex justify-content-between align-items-center">
+            <div class="fw-bold text-primary">₹{{ '%.2f'|format(p.price) }}</div>
+            <a class="btn btn-sm btn-success" href="{{ url_for('add_to_cart', id=p.product_id) }}">Add</a>
+        </div>
+      </div>
+    </div>
+    {% else %}
+    <div class="col-12 alert alert-light">No products</div>
+    {% endfor %}
+  </div>
+  <div class="mt-4">{{ pagination(page, total_pages, prev_url, next_url) }}</div>
+{% endblock %}
+""",
+
+'product.html': """{% extends "layout.html" %}
+{% block content %}
+  <div class="row">
+    <div class="col-md-5">
+      {% if p.image %}<picture>
+        <source type="image/webp" srcset="{{ image_url(p.image, 'detail', 'webp') }}">
+        <img src="{{ image_url(p.image, 'detail') }}" class="product-img mb-3 w-100" alt="{{ p.name }}">
+      </picture>{% endif %}
+    </div>
+    <div class="col-md-7">
+      <h2>{{ p.name }}</h2>
+      <p class="text-muted">Category: {{ p.category_name or 'Uncategorized' }}</p>
+      <p>{{ p.description or '' }}</p>
+      <h4 class="text-primary">₹{{ '%.2f'|format(p.price) }}</h4>
+      {% if not in_stock(p) %}<p class="badge bg-secondary">Out of stock</p>{% endif %}
+      <a class="btn btn-success me-2" href="{{ url_for('add_to_cart', id=p.product_id) }}">Add to Cart</a>
+      <a class="btn btn-outline-secondary" href="{{ url_for('index') }}">Back</a>
+    </div>
+  </div>
+  {% if related %}
+  <h5 class="mt-4">Frequently bought together</h5>
+  <div class="row g-3">
+    {% for r in related %}
+    <div class="col-md-3">
+      <div class="card p-3 card-hover">
+        {% if r.image %}<img src="{{ image_url(r.image, 'thumb') }}" class="mb-2 rounded" alt="" width="80" height="80" loading="lazy">{% endif %}
+        <h6><a href="{{ url_for('product', id=r.product_id) }}" class="text-decoration-none">{{ r.name }}</a></h6>
+        <div class="fw-bold text-primary">₹{{ '%.2f'|format(r.price) }}</div>
+      </div>
+    </div>
+    {% endfor %}
+  </div>
+  {% endif %}
+{% endblock %}
+""",
+
+'cart.html': """{% extends "layout.html" %}
+{% block content %}
+  <h3>Your Cart</h3>
+  {% for p in products %}
+  <div class="card mb-2 p-3 d-flex justify-content-between align-items-center">
+    <div>
+      {% if p.image %}<img src="{{ image_url(p.image, 'thumb') }}" class="me-2 rounded" alt="" width="64" height="64" loading="lazy">{% endif %}
+      <h6>{{ p.name }}</h6>
+      <div class="text-muted small">{{ (p.description or '')[:80] }}</div>
+    </div>
+    <div class="text-end">
+      <div class="fw-bold">₹{{ '%.2f'|format(p.price) }} x {{ p.quantity }}</div>
+      <form class="d-inline-flex mt-2" method="post" action="{{ url_for('update_cart', id=p.product_id) }}">
+        <input class="form-control form-control-sm me-1" style="width:70px" type="number" min="0" name="quantity" value="{{ p.quantity }}">
+        <button class="btn btn-sm btn-outline-secondary me-1">Update</button>
+      </form>
+      <a href="{{ url_for('remove_from_cart', id=p.product_id) }}" class="btn btn-sm btn-outline-danger mt-2">Remove</a>
+    </div>
+  </div>
+  {% endfor %}
+  <div class="d-flex justify-content-between align-items-center mt-3">
+    <div><strong>Total:</strong> ₹{{ '%.2f'|format(total) }}</div>
+    <div>
+      <a class="btn btn-secondary" href="{{ url_for('index') }}">Continue Shopping</a>
+      <a class="btn btn-primary" href="{{ url_for('checkout') }}">Checkout</a>
+    </div>
+  </div>
+{% endblock %}
+""",
+
+'checkout.html': """{% extends "layout.html" %}
+{% block content %}
+  <div class="row">
+    <div class="col-md-7">
+      <div class="card p-3">
+        <h4>Choose Payment Method</h4>
+        <form method="post">
+          <input type="hidden" name="token" value="{{ token }}">
+          <div class="mb-3">
+            <label class="form-label">Select</label>
+            <select id="paymode" name="payment_mode" class="form-select" required onchange="toggleFields()">
+              <option value="cod">Cash on Delivery</option>
+              <option value="upi">UPI</option>
+              <option value="card">Card</option>
+            </select>
+          </div>
+
+          <div id="upi_fields" style="display:none;">
+            <div class="mb-2">
+              <label class="form-label">UPI ID (fake ok)</label>
+              <input class="form-control" name="upi_id" placeholder="demo@upi">
             </div>
           </div>
-        </nav>
 
-        <main class="container mt-4">
-            {body_html}
-        </main>
+          <div id="card_fields" style="display:none;">
+            <div class="mb-2"><label class="form-label">Card Number (fake)</label><input class="form-control" name="card_no" placeholder="411111111111"></div>
+            <div class="mb-2"><label class="form-label">Name on Card</label><input class="form-control" name="card_name" placeholder="Full Name"></div>
+            <div class="row">
+              <div class="col"><input class="form-control" name="card_exp" placeholder="MM/YY"></div>
+              <div class="col"><input class="form-control" name="card_cvv" placeholder="CVV"></div>
+            </div>
+          </div>
 
-        <footer class="text-center">
-          <div class="container">
-            <small>© 2025 LunaShop — College Project</small>
+          <div class="mt-3">
+            <button class="btn btn-success">Place Order</button>
+            <a class="btn btn-outline-secondary ms-2" href="{{ url_for('cart') }}">Back to Cart</a>
           </div>
-        </footer>
+        </form>
+      </div>
+    </div>
 
-        <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js"></script>
-      </body>
-    </html>
-    """
-    return template
+    <div class="col-md-5">
+      <div class="card p-3">
+        <h5>Order Summary</h5>
+        <hr>
+        {% for p in products %}<div class='d-flex justify-content-between'><div>{{ p.name }} x{{ p.quantity }}</div><div>₹{{ '%.2f'|format(p.line_total) }}</div></div>{% endfor %}
+        <hr>
+        <div class="d-flex justify-content-between fw-bold">Total <div>₹{{ '%.2f'|format(total) }}</div></div>
+      </div>
+    </div>
+  </div>
+
+  <script>
+    function toggleFields(){
+      var v=document.getElementById('paymode').value;
+      document.getElementById('upi_fields').style.display = v=='upi' ? 'block' : 'none';
+      document.getElementById('card_fields').style.display = v=='card' ? 'block' : 'none';
+    }
+    // init
+    toggleFields();
+  </script>
+{% endblock %}
+""",
+
+'order_placed.html': """{% extends "layout.html" %}
+{% block content %}
+  <div class="card p-4">
+    <h3 class="text-success">Order Placed Successfully ✅</h3>
+    <p>Order ID: <strong>#{{ order_id }}</strong></p>
+    <p>Total Paid: <strong>₹{{ '%.2f'|format(total) }}</strong></p>
+    <p>Payment Method: <strong>{{ payment_mode|upper }}</strong></p>
+    <p>Payment Info: <strong>{{ payment_info }}</strong></p>
+    {% if short %}<div class="alert alert-warning">Not enough stock, left in your cart: {{ short|map(attribute='name')|join(', ') }}</div>{% endif %}
+    <a class="btn btn-primary mt-3" href="{{ url_for('orders') }}">View My Orders</a>
+    <a class="btn btn-outline-secondary mt-3 ms-2" href="{{ url_for('index') }}">Continue Shopping</a>
+  </div>
+{% endblock %}
+""",
+
+'admin.html': """{% extends "layout.html" %}
+{% block content %}
+  <h3 class="mb-3">Sales dashboard</h3>
+  <div class="row mb-4">
+    <div class="col card p-3 m-1"><div class="small text-muted">Orders ({{ days|length }} days)</div><h4>{{ totals.orders }}</h4></div>
+    <div class="col card p-3 m-1"><div class="small text-muted">Units sold</div><h4>{{ totals.units }}</h4></div>
+    <div class="col card p-3 m-1"><div class="small text-muted">Revenue</div><h4>₹{{ '%.2f'|format(totals.revenue) }}</h4></div>
+  </div>
+  <div class="row">
+    <div class="col-md-4">
+      <h5>Daily revenue</h5>
+      <table class="table table-sm">
+        <tr><th>Day</th><th class="text-end">Orders</th><th class="text-end">Revenue</th></tr>
+        {% for d in days %}<tr><td>{{ d.day }}</td><td class="text-end">{{ d.orders }}</td><td class="text-end">₹{{ '%.2f'|format(d.revenue) }}</td></tr>{% endfor %}
+      </table>
+    </div>
+    <div class="col-md-4">
+      <h5>Top products</h5>
+      <table class="table table-sm">
+        <tr><th>Product</th><th class="text-end">Units</th><th class="text-end">Revenue</th></tr>
+        {% for p in top %}<tr><td><a href="{{ url_for('product', id=p.product_id) }}">{{ p.name or '#%d'|format(p.product_id) }}</a></td><td class="text-end">{{ p.units }}</td><td class="text-end">₹{{ '%.2f'|format(p.revenue) }}</td></tr>{% endfor %}
+      </table>
+    </div>
+    <div class="col-md-4">
+      <h5>By category</h5>
+      <table class="table table-sm">
+        <tr><th>Category</th><th class="text-end">Units</th><th class="text-end">Revenue</th></tr>
+        {% for c in cats %}<tr><td>{{ c.name or 'Uncategorized' }}</td><td class="text-end">{{ c.units }}</td><td class="text-end">₹{{ '%.2f'|format(c.revenue) }}</td></tr>{% endfor %}
+      </table>
+    </div>
+  </div>
+{% endblock %}
+""",
+
+'orders.html': """{% extends "layout.html" %}
+{% from "macros.html" import pagination %}
+{% block content %}
+  {% for o in orders %}
+  <div class="card mb-3 p-3">
+    <div class="d-flex justify-content-between">
+      <div>
+        <h6>Order #{{ o.order_id }}</h6>
+        <div class="small text-muted">Placed: {{ o.created_at }}</div>
+        <div class="mt-2"><strong>Status:</strong> {{ o.status }}</div>
+      </div>
+      <div class="text-end">
+        <div class="fw-bold">₹{{ '%.2f'|format(o.total_amount) }}</div>
+      </div>
+    </div>
+    <hr>
+    <ul class="mb-0">{% for it in items.get(o.order_id, []) %}<li>{{ it.name }} x{{ it.quantity }} - ₹{{ '%.2f'|format(it.price) }}</li>{% endfor %}</ul>
+  </div>
+  {% endfor %}
+  <div class="mt-4">{{ pagination(page, None, prev_url, next_url) }}</div>
+{% endblock %}
+""",
+}
+
+app.jinja_loader = DictLoader(TEMPLATES)
+
+def warm_templates():
+    """Compile every template up front so no request pays for parsing."""
+    for name in TEMPLATES:
+        app.jinja_env.get_template(name)
+
+warm_templates()
+
+@app.context_processor
+def inject_nav():
+    return {'nav': nav_data()}
+
+def render_message(title, message):
+    return render_template("message.html", title=title, message=message)
 
 # ---------------- AUTH ----------------
 @app.route('/register', methods=['GET','POST'])
@@ -130,7 +1865,7 @@ def register():
         if not username or not email or not pw:
             flash("All fields required","danger")
             return redirect(url_for('register'))
-        conn = get_db()
+        conn = get_db(write=True)
         try:
             conn.execute("INSERT INTO users (username,email,password,is_admin) VALUES (?,?,?,0)", (username, email, hash_pw(pw)))
             conn.commit()
@@ -139,32 +1874,7 @@ def register():
         except sqlite3.IntegrityError:
             flash("Email already registered.","danger")
             return redirect(url_for('register'))
-
-    html = """
-      <div class="row justify-content-center">
-        <div class="col-md-6">
-          <div class="card p-4">
-            <h4>Register</h4>
-            <form method="post">
-              <div class="mb-2">
-                <label class="form-label">Username</label>
-                <input class="form-control" name="username" required>
-              </div>
-              <div class="mb-2">
-                <label class="form-label">Email</label>
-                <input class="form-control" type="email" name="email" required>
-              </div>
-              <div class="mb-3">
-                <label class="form-label">Password</label>
-                <input class="form-control" type="password" name="password" required>
-              </div>
-              <button class="btn btn-primary">Create account</button>
-            </form>
-          </div>
-        </div>
-      </div>
-    """
-    return render_template_string(site_base("Register", html))
+    return render_template("register.html", title="Register")
 
 @app.route('/login', methods=['GET','POST'])
 def login():
@@ -177,33 +1887,13 @@ def login():
             session['user_id'] = user['user_id']
             session['username'] = user['username']
             session['is_admin'] = bool(user['is_admin'])
+            session['cart_id'] = user_cart_id(user['user_id'])
             flash("Logged in","success")
             return redirect(url_for('index'))
         else:
             flash("Invalid credentials","danger")
             return redirect(url_for('login'))
-
-    html = """
-      <div class="row justify-content-center">
-        <div class="col-md-5">
-          <div class="card p-4">
-            <h4>Login</h4>
-            <form method="post">
-              <div class="mb-2">
-                <label class="form-label">Email</label>
-                <input class="form-control" name="email" type="email" required>
-              </div>
-              <div class="mb-3">
-                <label class="form-label">Password</label>
-                <input class="form-control" name="password" type="password" required>
-              </div>
-              <button class="btn btn-primary">Login</button>
-            </form>
-          </div>
-        </div>
-      </div>
-    """
-    return render_template_string(site_base("Login", html))
+    return render_template("login.html", title="Login")
 
 @app.route('/logout')
 def logout():
@@ -212,124 +1902,83 @@ def logout():
     return redirect(url_for('index'))
 
 # ---------------- PRODUCT LIST / SEARCH ----------------
+# Listing queries shared by the HTML pages and the JSON API.
+def product_listing(q, page, cursor, sort='newest', min_price=None, max_price=None):
+    """Home (sorted, price-filtered, cursor paged) or search (relevance, page numbers) listing."""
+    if not q:
+        return browse_listing(None, page, cursor, sort, min_price, max_price)
+    # relevance order has no stable key to seek on, so search keeps page numbers
+    total, products = search_products(q, page)
+    return {'products': products, 'total': total, 'page': page, 'total_pages': max(1, (total + PER_PAGE -1)//PER_PAGE),
+            'next_cursor': None, 'prev_cursor': None, 'sort': None, 'facets': None}
+
+def category_listing(id, page, cursor, sort='newest', min_price=None, max_price=None):
+    """(category row, listing) for a category page, or (None, None) if it doesn't exist."""
+    cat = get_db().execute("SELECT * FROM categories WHERE category_id=?", (id,)).fetchone()
+    if not cat:
+        return None, None
+    return cat, browse_listing(id, page, cursor, sort, min_price, max_price)
+
+def url_options(sort, min_price, max_price):
+    """The non-default listing options, for building links that keep them."""
+    opts = {'sort': sort if sort != 'newest' else None, 'min_price': min_price, 'max_price': max_price}
+    return {k: v for k, v in opts.items() if v is not None}
+
+PRODUCT_SQL = "SELECT p.*, c.name as category_name FROM products p LEFT JOIN categories c ON p.category_id=c.category_id WHERE product_id=?"
+
+def get_product(id):
+    return get_db().execute(PRODUCT_SQL, (id,)).fetchone()
+
 @app.route('/')
+@conditional_get
+@cached_page(lambda: {'search' if request.args.get('q') else 'home'})
 def index():
     q = request.args.get('q','').strip()
-    page = int(request.args.get('page',1))
-    db = get_db()
+    page = request.args.get('page', 1, type=int)
+    sort, min_price, max_price = listing_options(request.args)
+    listing = product_listing(q, page, request.args.get('cursor'), sort, min_price, max_price)
+    page, total_pages = listing['page'], listing['total_pages']
+    opts = url_options(sort, min_price, max_price)
 
-    params = tuple()
     if q:
-        like = f"%{q}%"
-        total = db.execute("SELECT COUNT(*) as c FROM products WHERE name LIKE ? OR description LIKE ?", (like, like)).fetchone()['c']
-        products = paginate("SELECT * FROM products WHERE name LIKE ? OR description LIKE ? ORDER BY product_id DESC", (like, like), page)
-        title = f"Search: {q}"
+        heading = f"Search: {q}"
+        prev_url = url_for('index', q=q, page=page-1) if page > 1 else None
+        next_url = url_for('index', q=q, page=page+1) if page < total_pages else None
     else:
-        total = db.execute("SELECT COUNT(*) as c FROM products").fetchone()['c']
-        products = paginate("SELECT * FROM products ORDER BY product_id DESC", (), page)
-        title = "Featured Products"
-
-    total_pages = max(1, (total + PER_PAGE -1)//PER_PAGE)
-
-    cards = ""
-    for p in products:
-        img_html = ""
-        if p['image']:
-            img_html = f'<img src="/static/images/{p["image"]}" class="product-img w-100 mb-2" alt="{p["name"]}">'
-        cards += f"""
-            <div class="col-md-3">
-              <div class="card card-hover p-3">
-                {img_html}
-                <h6><a href="{url_for('product', id=p['product_id'])}" class="text-decoration-none">{p['name']}</a></h6>
-                <p class="text-muted small">{(p['description'] or '')[:90]}</p>
-                <div class="d-flex justify-content-between align-items-center mt-2">
-                    <div class="fw-bold text-primary">₹{p['price']:.2f}</div>
-                    <div>
-                        <a href="{url_for('product', id=p['product_id'])}" class="btn btn-sm btn-outline-secondary me-1">View</a>
-                        <a href="{url_for('add_to_cart', id=p['product_id'])}" class="btn btn-sm btn-success">Add to Cart</a>
-                    </div>
-                </div>
-              </div>
-            </div>
-        """
-
-    pagination_html = f"""
-      <nav aria-label="page-nav">
-        <ul class="pagination">
-          <li class="page-item {'disabled' if page<=1 else ''}">
-            <a class="page-link" href="{url_for('index')}?page={page-1}&q={q}">Previous</a>
-          </li>
-          <li class="page-item disabled"><span class="page-link">Page {page}/{total_pages}</span></li>
-          <li class="page-item {'disabled' if page>=total_pages else ''}">
-            <a class="page-link" href="{url_for('index')}?page={page+1}&q={q}">Next</a>
-          </li>
-        </ul>
-      </nav>
-    """
+        heading = "Featured Products"
+        prev_url = url_for('index', cursor=listing['prev_cursor'], **opts) if listing['prev_cursor'] else None
+        next_url = url_for('index', cursor=listing['next_cursor'], **opts) if listing['next_cursor'] else None
 
-    html = f"""
-      <div class="mb-3">
-        <h2>{title}</h2>
-      </div>
-      <div class="row g-3">
-        {cards or '<div class="col-12"><div class="alert alert-light">No products found.</div></div>'}
-      </div>
-      <div class="mt-4">{pagination_html}</div>
-    """
-    return render_template_string(site_base("Home", html))
+    return stream_page("index.html", title="Home", heading=heading, products=listing['products'],
+                       page=page, total_pages=total_pages, prev_url=prev_url, next_url=next_url,
+                       facets=listing['facets'], opts=opts)
 
 @app.route('/category/<int:id>')
+@conditional_get
+@cached_page(lambda id: {f"category:{id}"})
 def category(id):
-    page = int(request.args.get('page',1))
-    db = get_db()
-    cat = db.execute("SELECT * FROM categories WHERE category_id=?", (id,)).fetchone()
+    page = request.args.get('page', 1, type=int)
+    sort, min_price, max_price = listing_options(request.args)
+    cat, listing = category_listing(id, page, request.args.get('cursor'), sort, min_price, max_price)
     if not cat:
-        return render_template_string(site_base("Category", "<h3>Category not found</h3>"))
-    total = db.execute("SELECT COUNT(*) as c FROM products WHERE category_id=?", (id,)).fetchone()['c']
-    products = paginate("SELECT * FROM products WHERE category_id=? ORDER BY product_id DESC", (id,), page)
-    cards = ""
-    for p in products:
-        cards += f"""
-            <div class="col-md-3">
-              <div class="card p-3 card-hover">
-                <h6><a href="{url_for('product', id=p['product_id'])}">{p['name']}</a></h6>
-                <p class="text-muted small">{(p['description'] or '')[:80]}</p>
-                <div class="d-flex justify-content-between align-items-center">
-                    <div class="fw-bold text-primary">₹{p['price']:.2f}</div>
-                    <a class="btn btn-sm btn-success" href="{url_for('add_to_cart', id=p['product_id'])}">Add</a>
-                </div>
-              </div>
-            </div>
-        """
-    html = f"""
-      <h2>Category: {cat['name']}</h2>
-      <div class="row g-3">{cards or '<div class="col-12 alert alert-light">No products</div>'}</div>
-    """
-    return render_template_string(site_base(cat['name'], html))
+        return render_message("Category", "Category not found")
+    opts = url_options(sort, min_price, max_price)
+    prev_url = url_for('category', id=id, cursor=listing['prev_cursor'], **opts) if listing['prev_cursor'] else None
+    next_url = url_for('category', id=id, cursor=listing['next_cursor'], **opts) if listing['next_cursor'] else None
+    return stream_page("category.html", title=cat['name'], cat=cat, products=listing['products'],
+                       page=listing['page'], total_pages=listing['total_pages'], prev_url=prev_url, next_url=next_url,
+                       facets=listing['facets'], opts=opts)
 
 @app.route('/product/<int:id>')
+@conditional_get
+@cached_page(lambda id: {f"product:{id}"})
 def product(id):
-    db = get_db()
-    p = db.execute("SELECT p.*, c.name as category_name FROM products p LEFT JOIN categories c ON p.category_id=c.category_id WHERE product_id=?", (id,)).fetchone()
+    p = get_product(id)
     if not p:
-        return render_template_string(site_base("Product", "<h3>Product not found</h3>"))
-    img_html = f'<img src="/static/images/{p["image"]}" class="product-img mb-3 w-100">' if p['image'] else ''
-    html = f"""
-      <div class="row">
-        <div class="col-md-5">
-          {img_html}
-        </div>
-        <div class="col-md-7">
-          <h2>{p['name']}</h2>
-          <p class="text-muted">Category: {p['category_name'] or 'Uncategorized'}</p>
-          <p>{p['description'] or ''}</p>
-          <h4 class="text-primary">₹{p['price']:.2f}</h4>
-          <a class="btn btn-success me-2" href="{url_for('add_to_cart', id=p['product_id'])}">Add to Cart</a>
-          <a class="btn btn-outline-secondary" href="{url_for('index')}">Back</a>
-        </div>
-      </div>
-    """
-    return render_template_string(site_base(p['name'], html))
+        return render_message("Product", "Product not found")
+    related = related_products(id)
+    tag_page(*(f"product:{r['product_id']}" for r in related))  # their names and prices are on the page too
+    return render_template("product.html", title=p['name'], p=p, related=related)
 
 # ---------------- CART & CHECKOUT ----------------
 @app.route('/add_to_cart/<int:id>')
@@ -337,57 +1986,32 @@ def add_to_cart(id):
     if 'user_id' not in session:
         flash("Please login first","warning")
         return redirect(url_for('login'))
-    cart = session.get('cart', [])
-    cart.append(id)
-    session['cart'] = cart
+    cart_add(current_cart_id(create=True), id)
     flash("Added to cart","success")
     return redirect(url_for('cart'))
 
 @app.route('/cart')
 def cart():
-    cart = session.get('cart', [])
-    if not cart:
-        return render_template_string(site_base("Cart", "<h3>Your cart is empty.</h3>"))
-    db = get_db()
-    placeholders = ",".join("?"*len(cart))
-    products = db.execute(f"SELECT * FROM products WHERE product_id IN ({placeholders})", tuple(cart)).fetchall()
-    total = sum([p['price'] for p in products])
-    rows = ""
-    # count quantities
-    qty = {}
-    for pid in cart: qty[pid] = qty.get(pid,0)+1
-    for p in products:
-        q = qty.get(p['product_id'],1)
-        rows += f"""
-            <div class="card mb-2 p-3 d-flex justify-content-between align-items-center">
-              <div>
-                <h6>{p['name']}</h6>
-                <div class="text-muted small">{(p['description'] or '')[:80]}</div>
-              </div>
-              <div class="text-end">
-                <div class="fw-bold">₹{p['price']:.2f} x {q}</div>
-                <a href="{url_for('remove_from_cart', id=p['product_id'])}" class="btn btn-sm btn-outline-danger mt-2">Remove</a>
-              </div>
-            </div>
-        """
-    html = f"""
-      <h3>Your Cart</h3>
-      {rows}
-      <div class="d-flex justify-content-between align-items-center mt-3">
-        <div><strong>Total:</strong> ₹{total:.2f}</div>
-        <div>
-          <a class="btn btn-secondary" href="{url_for('index')}">Continue Shopping</a>
-          <a class="btn btn-primary" href="{url_for('checkout')}">Checkout</a>
-        </div>
-      </div>
-    """
-    return render_template_string(site_base("Cart", html))
+    products, total = cart_lines(current_cart_id())
+    if not products:
+        return render_message("Cart", "Your cart is empty.")
+    return render_template("cart.html", title="Cart", products=products, total=total)
+
+@app.route('/update_cart/<int:id>', methods=['POST'])
+def update_cart(id):
+    cid = current_cart_id()
+    if cid:
+        try:
+            cart_set(cid, id, int(request.form.get('quantity', 1)))
+        except ValueError:
+            flash("Enter a valid quantity","danger")
+    return redirect(url_for('cart'))
 
 @app.route('/remove_from_cart/<int:id>')
 def remove_from_cart(id):
-    cart = session.get('cart', [])
-    new = [x for x in cart if x!=id]
-    session['cart'] = new
+    cid = current_cart_id()
+    if cid:
+        cart_remove(cid, id)
     flash("Removed from cart","info")
     return redirect(url_for('cart'))
 
@@ -396,16 +2020,10 @@ def checkout():
     if 'user_id' not in session:
         flash("Please login to checkout","warning")
         return redirect(url_for('login'))
-    cart = session.get('cart', [])
-    if not cart:
-        flash("Cart empty","warning")
-        return redirect(url_for('index'))
-    db = get_db()
-    placeholders = ",".join("?"*len(cart))
-    prods = db.execute(f"SELECT * FROM products WHERE product_id IN ({placeholders})", tuple(cart)).fetchall()
-    total = sum([p['price'] for p in prods])
+    cid = current_cart_id()
 
     if request.method=='POST':
+        token = request.form.get('token') or secrets.token_urlsafe(16)
         payment_mode = request.form.get('payment_mode')
         payment_info = ''
         if payment_mode == 'card':
@@ -425,133 +2043,565 @@ def checkout():
         else:
             payment_info = "Cash on Delivery"
 
-        # create order
-        cur = db.cursor()
+        # create order (or find the one this form already created)
         status = f"Placed - {payment_mode.upper()}"
-        cur.execute("INSERT INTO orders (user_id,total_amount,status) VALUES (?,?,?)", (session['user_id'], total, status))
-        order_id = cur.lastrowid
-        # build qty map
-        qty={}
-        for pid in cart: qty[pid]=qty.get(pid,0)+1
-        for p in prods:
-            q = qty.get(p['product_id'],1)
-            cur.execute("INSERT INTO order_items (order_id,product_id,quantity,price) VALUES (?,?,?,?)", (order_id, p['product_id'], q, p['price']))
-        db.commit()
-        # clear cart
-        session.pop('cart', None)
-
-        # show confirmation
-        conf_html = f"""
-          <div class="card p-4">
-            <h3 class="text-success">Order Placed Successfully ✅</h3>
-            <p>Order ID: <strong>#{order_id}</strong></p>
-            <p>Total Paid: <strong>₹{total:.2f}</strong></p>
-            <p>Payment Method: <strong>{payment_mode.upper()}</strong></p>
-            <p>Payment Info: <strong>{payment_info}</strong></p>
-            <a class="btn btn-primary mt-3" href="{url_for('orders')}">View My Orders</a>
-            <a class="btn btn-outline-secondary mt-3 ms-2" href="{url_for('index')}">Continue Shopping</a>
-          </div>
-        """
-        return render_template_string(site_base("Order Placed", conf_html))
+        order, short = place_order(session['user_id'], cid, token, status)
+        if not order and short:
+            flash("Not enough stock for: " + ", ".join(p['name'] for p in short),"danger")
+            return redirect(url_for('cart'))
+        if not order:
+            flash("Cart empty","warning")
+            return redirect(url_for('index'))
 
+        return render_template("order_placed.html", title="Order Placed", order_id=order['order_id'], total=order['total_amount'],
+                               payment_mode=payment_mode, payment_info=payment_info, short=short)
+
+    prods, total = cart_lines(cid)
+    if not prods:
+        flash("Cart empty","warning")
+        return redirect(url_for('index'))
     # GET -> render payment options form
-    form_html = f"""
-      <div class="row">
-        <div class="col-md-7">
-          <div class="card p-3">
-            <h4>Choose Payment Method</h4>
-            <form method="post">
-              <div class="mb-3">
-                <label class="form-label">Select</label>
-                <select id="paymode" name="payment_mode" class="form-select" required onchange="toggleFields()">
-                  <option value="cod">Cash on Delivery</option>
-                  <option value="upi">UPI</option>
-                  <option value="card">Card</option>
-                </select>
-              </div>
-
-              <div id="upi_fields" style="display:none;">
-                <div class="mb-2">
-                  <label class="form-label">UPI ID (fake ok)</label>
-                  <input class="form-control" name="upi_id" placeholder="demo@upi">
-                </div>
-              </div>
-
-              <div id="card_fields" style="display:none;">
-                <div class="mb-2"><label class="form-label">Card Number (fake)</label><input class="form-control" name="card_no" placeholder="411111111111"></div>
-                <div class="mb-2"><label class="form-label">Name on Card</label><input class="form-control" name="card_name" placeholder="Full Name"></div>
-                <div class="row">
-                  <div class="col"><input class="form-control" name="card_exp" placeholder="MM/YY"></div>
-                  <div class="col"><input class="form-control" name="card_cvv" placeholder="CVV"></div>
-                </div>
-              </div>
-
-              <div class="mt-3">
-                <button class="btn btn-success">Place Order</button>
-                <a class="btn btn-outline-secondary ms-2" href="{url_for('cart')}">Back to Cart</a>
-              </div>
-            </form>
-          </div>
-        </div>
+    return render_template("checkout.html", title="Checkout", products=prods, total=total, token=secrets.token_urlsafe(16))
 
-        <div class="col-md-5">
-          <div class="card p-3">
-            <h5>Order Summary</h5>
-            <hr>
-            {"".join([f"<div class='d-flex justify-content-between'><div>{p['name']}</div><div>₹{p['price']:.2f}</div></div>" for p in prods])}
-            <hr>
-            <div class="d-flex justify-content-between fw-bold">Total <div>₹{total:.2f}</div></div>
-          </div>
-        </div>
-      </div>
+# ---------------- ORDERS ----------------
+ORDER_KEY = ("created_at", "order_id")   # /orders keyset, newest first
 
-      <script>
-        function toggleFields(){{
-          var v=document.getElementById('paymode').value;
-          document.getElementById('upi_fields').style.display = v=='upi' ? 'block' : 'none';
-          document.getElementById('card_fields').style.display = v=='card' ? 'block' : 'none';
-        }}
-        // init
-        toggleFields();
-      </script>
-    """
-    return render_template_string(site_base("Checkout", form_html))
+def order_items_sql(n):
+    """Items (with product names) of n orders at once."""
+    return (f"SELECT oi.*, p.name FROM order_items oi LEFT JOIN products p ON p.product_id=oi.product_id "
+            f"WHERE oi.order_id IN ({','.join('?' * n)})")
 
-# ---------------- ORDERS ----------------
 @app.route('/orders')
 def orders():
     if 'user_id' not in session:
         flash("Please login to view orders","warning")
         return redirect(url_for('login'))
-    db = get_db()
-    rows = db.execute("SELECT * FROM orders WHERE user_id=? ORDER BY created_at DESC", (session['user_id'],)).fetchall()
+    # one page of orders by (created_at, order_id) cursor, then all of their items in one query
+    rows, page, next_cur, prev_cur = seek_page("user_id=?", (session['user_id'],), request.args.get('cursor'), 1,
+                                               ORDERS_PER_PAGE, table="orders", key=ORDER_KEY)
     if not rows:
-        html = "<h3>No orders yet</h3>"
-        return render_template_string(site_base("Orders", html))
-    out = ""
-    for o in rows:
-        items = db.execute("SELECT oi.*, p.name FROM order_items oi LEFT JOIN products p ON p.product_id=oi.product_id WHERE oi.order_id=?", (o['order_id'],)).fetchall()
-        items_html = "".join([f"<li>{it['name']} x{it['quantity']} - ₹{it['price']:.2f}</li>" for it in items])
-        out += f"""
-          <div class="card mb-3 p-3">
-            <div class="d-flex justify-content-between">
-              <div>
-                <h6>Order #{o['order_id']}</h6>
-                <div class="small text-muted">Placed: {o['created_at']}</div>
-                <div class="mt-2"><strong>Status:</strong> {o['status']}</div>
-              </div>
-              <div class="text-end">
-                <div class="fw-bold">₹{o['total_amount']:.2f}</div>
-              </div>
-            </div>
-            <hr>
-            <ul class="mb-0">{items_html}</ul>
-          </div>
-        """
-    return render_template_string(site_base("My Orders", out))
+        return render_message("Orders", "No orders yet")
+    ids = [o['order_id'] for o in rows]
+    items = {}
+    for it in get_db().execute(order_items_sql(len(ids)), ids):
+        items.setdefault(it['order_id'], []).append(it)
+    prev_url = url_for('orders', cursor=prev_cur) if prev_cur else None
+    next_url = url_for('orders', cursor=next_cur) if next_cur else None
+    return render_template("orders.html", title="My Orders", orders=rows, items=items,
+                           page=page, prev_url=prev_url, next_url=next_url)
+
+# ---------------- ADMIN ----------------
+@app.route('/admin')
+def admin():
+    if not session.get('is_admin'):
+        abort(403)
+    # every query reads a bounded slice of a summary table by its index, so the
+    # dashboard costs the same however many orders there are
+    db = get_db()
+    days = db.execute("SELECT * FROM sales_daily ORDER BY day DESC LIMIT ?", (SALES_DAYS,)).fetchall()
+    top = db.execute("SELECT s.*, p.name FROM sales_products s LEFT JOIN products p ON p.product_id=s.product_id "
+                     "ORDER BY s.revenue DESC, s.product_id DESC LIMIT ?", (TOP_PRODUCTS,)).fetchall()
+    cats = db.execute("SELECT s.*, c.name FROM sales_categories s LEFT JOIN categories c ON c.category_id=s.category_id "
+                      "ORDER BY s.revenue DESC, s.category_id DESC").fetchall()
+    totals = {k: sum(d[k] for d in days) for k in ('orders', 'units', 'revenue')}
+    return render_template("admin.html", title="Dashboard", days=days, top=top, cats=cats, totals=totals)
+
+# ---------------- JSON API ----------------
+# Machine-readable catalog for partners and the mobile app, on the same queries
+# (and conditional GET handling) as the HTML pages.
+PRODUCT_FIELDS = ('product_id', 'name', 'description', 'price', 'image', 'category_id')
+
+def product_json(p):
+    d = {k: p[k] for k in PRODUCT_FIELDS}
+    if 'category_name' in p.keys():
+        d['category_name'] = p['category_name']
+    d['in_stock'] = in_stock(p)
+    d['url'] = url_for('product', id=p['product_id'], _external=True)
+    return d
+
+def listing_json(listing):
+    return {'products': [product_json(p) for p in listing['products']],
+            'total': listing['total'], 'page': listing['page'], 'total_pages': listing['total_pages'],
+            'next_cursor': listing['next_cursor'], 'prev_cursor': listing['prev_cursor'],
+            'sort': listing['sort'], 'facets': listing['facets']}
+
+@app.route('/api/products')
+@conditional_get
+def api_products():
+    listing = product_listing(request.args.get('q','').strip(), request.args.get('page', 1, type=int), request.args.get('cursor'),
+                              *listing_options(request.args))
+    return jsonify(listing_json(listing))
+
+@app.route('/api/products/<int:id>')
+@conditional_get
+def api_product(id):
+    p = get_product(id)
+    if not p:
+        return jsonify(error="product not found"), 404
+    return jsonify(product_json(p))
+
+@app.route('/api/categories')
+@conditional_get
+def api_categories():
+    cats = get_db().execute("SELECT category_id, name FROM categories ORDER BY name").fetchall()
+    return jsonify(categories=[dict(c) for c in cats])
+
+@app.route('/api/categories/<int:id>')
+@conditional_get
+def api_category(id):
+    cat, listing = category_listing(id, request.args.get('page', 1, type=int), request.args.get('cursor'), *listing_options(request.args))
+    if not cat:
+        return jsonify(error="category not found"), 404
+    return jsonify(category={'category_id': cat['category_id'], 'name': cat['name']}, **listing_json(listing))
+
+@app.route('/api/autocomplete')
+def api_autocomplete():
+    q = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), AUTOCOMPLETE_MAX_LIMIT))
+    found = autocomplete_index().search(q, limit)
+    return jsonify({'q': q, 'results': [{'product_id': pid, 'name': name, 'url': url_for('product', id=pid)}
+                                        for pid, name in found]})
+
+@app.route('/api/feed.ndjson')
+def api_feed():
+    """Whole catalog, one JSON product per line, streamed straight off a db cursor."""
+    def generate():
+        buf = []
+        size = 0
+        for p in get_db().execute("SELECT p.*, c.name AS category_name FROM products p "
+                                  "LEFT JOIN categories c ON c.category_id=p.category_id ORDER BY p.product_id"):
+            line = json.dumps({**{k: p[k] for k in PRODUCT_FIELDS + ('category_name',)}, 'in_stock': in_stock(p)},
+                              ensure_ascii=False) + "\n"
+            buf.append(line)
+            size += len(line)
+            if size >= FEED_CHUNK_BYTES:
+                yield "".join(buf)
+                buf, size = [], 0
+        if buf:
+            yield "".join(buf)
+    return app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+# ---------------- MIGRATIONS ----------------
+# Numbered schema steps on top of schema.sql, tracked in PRAGMA user_version.
+# migrate() runs on the first connection of each process (and via
+# `flask migrate-db`), applying each missing step in its own transaction.
+# Steps are idempotent so dbs touched by earlier ad-hoc upgrades are safe.
+# A fresh schema.sql db already sets user_version to the latest step.
+INDEX_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id, product_id);
+CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders(user_id, created_at, order_id);
+CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id, product_id, quantity, price);
+"""
+
+def run_script(db, sql):
+    """Like executescript, but statement by statement so it stays inside the caller's transaction."""
+    stmt = ""
+    for line in sql.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            db.execute(stmt)
+            stmt = ""
+
+def add_column(db, table, column, decl):
+    """ALTER TABLE ADD COLUMN unless the table is missing or already has it."""
+    cols = [r[1] for r in db.execute(f"PRAGMA table_info({table})")]
+    if cols and column not in cols:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def migrate_catalog_meta(db):
+    add_column(db, "catalog_meta", "updated_at", "INTEGER NOT NULL DEFAULT 0")
+    run_script(db, META_SCHEMA)
+
+def migrate_checkout_token(db):
+    add_column(db, "orders", "checkout_token", "TEXT")
+    run_script(db, ORDER_SCHEMA)
+
+# DDL a running bulk_load() has dropped, for restore_deferred()
+BULK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS deferred_ddl (name TEXT PRIMARY KEY, tbl_name TEXT NOT NULL, sql TEXT NOT NULL);
+"""
+
+MIGRATIONS = [
+    (1, "full-text search index", init_search),
+    (2, "catalog versions", migrate_catalog_meta),
+    (3, "catalog change log", CHANGES_SCHEMA),
+    (4, "server-side carts", CART_SCHEMA),
+    (5, "checkout idempotency token", migrate_checkout_token),
+    (6, "hot-path indexes", INDEX_SCHEMA),
+    (7, "inventory", migrate_stock),
+    (8, "sales aggregates", migrate_sales),
+    (9, "listing sorts and facets", migrate_listing_sorts),
+    (10, "co-purchase recommendations", RECOMMEND_SCHEMA),
+    (11, "crash-safe bulk loads", BULK_SCHEMA),
+]
+
+def migrate(db, echo=None):
+    """Upgrade db in place to the latest migration; returns its version."""
+    if not db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='products'").fetchone():
+        return 0  # not created from schema.sql yet
+    for version, name, step in MIGRATIONS:
+        if db.execute("PRAGMA user_version").fetchone()[0] >= version:
+            continue
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have applied it while we waited for the lock
+            if db.execute("PRAGMA user_version").fetchone()[0] < version:
+                run_script(db, step) if isinstance(step, str) else step(db)
+                db.execute(f"PRAGMA user_version={version}")
+                if echo: echo(f"applied migration {version}: {name}")
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    if db.execute("SELECT 1 FROM deferred_ddl LIMIT 1").fetchone():
+        restore_deferred(db)  # a bulk load died midway
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+# The SQL each hot route runs, built by the same helpers and constants the
+# routes use. check-query-plans fails if any of them scans a table or sorts
+# with a temp b-tree, except for the plan steps a query explicitly allows.
+def hot_queries():
+    """[(label, sql, params, allowed plan steps)] for check-query-plans."""
+    queries = []
+    for category_id in (None, 1):
+        route = "category" if category_id else "index"
+        for min_price, max_price in ((None, None), (100, 500)):
+            where, params = browse_where(category_id, min_price, max_price)
+            for sort, (key, desc) in SORT_KEYS.items():
+                label = f"{route}: {sort}" + (" in price range" if min_price is not None else "")
+                # the unfiltered home page walks the sort's index (or the rowid
+                # b-tree) in order and stops at LIMIT
+                walk = ("SCAN products",) if category_id is None and min_price is None else ()
+                # a price range with a non-price sort seeks the range, then sorts
+                # it: no index serves both, and a range is one narrow bucket
+                ranged_sort = ("USE TEMP B-TREE FOR ORDER BY",) if min_price is not None and key[0] != "price" else ()
+                queries += [
+                    (f"{label}, first page", seek_sql(where, key=key, desc=desc), params + (PER_PAGE + 1, 0), walk + ranged_sort),
+                    (f"{label}, next page", seek_sql(where, key=key, desc=desc, direction="n"),
+                     params + (1,) * len(key) + (PER_PAGE + 1,), ranged_sort),
+                ]
+        # one pass over the (category_id, price) index per catalog version;
+        # facet_matrix caches the result
+        queries.append((f"{route}: facets", facet_sql(), (), ("SCAN products USING COVERING INDEX idx_products_category_price",)))
+    sql, params = range_count_sql(150, 200)
+    queries.append(("index: facets, price range between bucket edges", sql, (1,) + params, ()))
+    queries += [
+        ("index: search count", SEARCH_COUNT_SQL, ('"a"*',), ()),
+        # bm25 ranks every match, so the matches are sorted; bounded by the match count
+        ("index: search results", SEARCH_SQL + " LIMIT ? OFFSET ?", ('"a"*', PER_PAGE, 0), ("USE TEMP B-TREE FOR ORDER BY",)),
+        ("product", PRODUCT_SQL, (1,), ()),
+        ("product: related", RELATED_SQL, (1, RELATED_PRODUCTS), ()),
+        ("cart: lines", CART_LINES_SQL, (1,), ()),
+        ("login: user cart", USER_CART_SQL, (1,), ()),
+        ("checkout: token", ORDER_TOKEN_SQL, ('t', 1), ()),
+        ("orders: first page", seek_sql("user_id=?", "orders", ORDER_KEY), (1, ORDERS_PER_PAGE + 1, 0), ()),
+        ("orders: next page", seek_sql("user_id=?", "orders", ORDER_KEY, direction="n"), (1, '2025-01-01', 1, ORDERS_PER_PAGE + 1), ()),
+        ("orders: items", order_items_sql(3), (1, 2, 3), ()),
+    ]
+    return queries
+
+def query_plan_problems(db):
+    """(label, plan detail) for every hot query step that scans a table or sorts, unless allowed."""
+    problems = []
+    for label, sql, params, allowed in hot_queries():
+        for row in db.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row[3]
+            if any(detail == a or detail.startswith(a + " USING ") for a in allowed):
+                continue
+            if (detail.startswith("SCAN ") and "VIRTUAL TABLE" not in detail) or "TEMP B-TREE" in detail:
+                problems.append((label, detail))
+    return problems
+
+@app.cli.command("migrate-db")
+def migrate_db_command():
+    """Upgrade the database schema in place."""
+    db = connect(DB)
+    click.echo(f"schema version {migrate(db, echo=click.echo)}")
+    db.close()
+
+@app.cli.command("rebuild-sales")
+def rebuild_sales_command():
+    """Recompute the dashboard's sales totals from the order history."""
+    db = connect(DB)
+    migrate(db)
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        rebuild_sales(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    click.echo(f"rebuilt sales totals for {db.execute('SELECT COUNT(*) FROM sales_daily').fetchone()[0]} days")
+    db.close()
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Fail if a hot route query falls back to a table scan."""
+    db = connect(DB)
+    migrate(db)
+    problems = query_plan_problems(db)
+    db.close()
+    for label, detail in problems:
+        click.echo(f"FAIL {label}: {detail}")
+    if problems:
+        raise SystemExit(1)
+    click.echo(f"ok: {len(hot_queries())} hot queries use indexes (or a plan step they allow)")
+
+# ---------------- CATALOG IMPORT ----------------
+# flask import-catalog FILE streams a CSV or JSONL feed into the catalog. Row
+# fields: name, price, and optionally product_id (upserts that product),
+# description, image, stock, and category (name, created if new) or category_id.
+# The FTS triggers are dropped for the load and the search index is rebuilt
+# once at the end, with one catalog version bump. Lookup indexes and the
+# version/change-log triggers stay, so the live site keeps seeking and caches
+# keep invalidating while a feed is imported. Whatever is dropped is saved in
+# deferred_ddl (BULK_SCHEMA) in the same transaction; if the load dies, the
+# next migrate() puts it back. (A process starting mid-load does that early;
+# harmless, since the load's own restore still rebuilds the FTS index.)
+@contextlib.contextmanager
+def bulk_load(db, tables=('products', 'categories'), drop_all=False):
+    """Defer the FTS triggers on `tables` while the block writes, then restore them.
+
+    drop_all defers every trigger and index on `tables` instead -- only for a db
+    nothing is serving yet (bench/datagen.py). See restore_deferred for the rest.
+    """
+    marks = ",".join("?" * len(tables))
+    db.execute("BEGIN IMMEDIATE")
+    deferred = db.execute(f"SELECT type, name, tbl_name, sql FROM sqlite_master WHERE type IN ('trigger','index') "
+                          f"AND tbl_name IN ({marks}) AND sql IS NOT NULL"
+                          + ("" if drop_all else " AND type='trigger' AND sql LIKE '%products_fts%'"), tables).fetchall()
+    for obj in deferred:
+        db.execute("INSERT OR REPLACE INTO deferred_ddl (name, tbl_name, sql) VALUES (?,?,?)", (obj['name'], obj['tbl_name'], obj['sql']))
+        db.execute(f"DROP {obj['type'].upper()} IF EXISTS {obj['name']}")
+    db.commit()
+    try:
+        yield
+    finally:
+        db.rollback()
+        restore_deferred(db, tables)
+
+def restore_deferred(db, tables=None):
+    """Recreate what bulk_load deferred and mark the whole catalog changed (commits).
+
+    Rebuilds the FTS index, bumps both catalog versions and logs a NULL
+    catalog_changes row so page caches start over; loaded orders or order_items
+    also recompute the sales totals. With tables=None (recovery from migrate)
+    it does nothing unless a load left DDL behind.
+    """
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        deferred = db.execute("SELECT tbl_name, sql FROM deferred_ddl").fetchall()
+        if tables is None and not deferred:
+            db.rollback()
+            return
+        for obj in deferred:
+            db.execute(obj['sql'])
+        db.execute("DELETE FROM deferred_ddl")
+        db.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+        db.execute("UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) "
+                   "WHERE key IN ('products', 'categories')")
+        db.execute("INSERT INTO catalog_changes (product_id, category_id) VALUES (NULL, NULL)")
+        if {'orders', 'order_items'} & set(tables or [obj['tbl_name'] for obj in deferred]):
+            rebuild_sales(db)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def read_catalog(path, fmt):
+    """Feed rows as dicts; a JSONL line that isn't a JSON object comes out as None."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    try:
+                        row = json.loads(line)
+                    except json.JSONDecodeError:
+                        row = None
+                    yield row if isinstance(row, dict) else None
+
+def import_catalog(path, fmt=None, batch_size=IMPORT_BATCH, echo=print):
+    """Upsert every row of the feed; returns (imported, skipped)."""
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    db = connect(DB)
+    migrate(db)
+    cats = {c['name']: c['category_id'] for c in db.execute("SELECT category_id, name FROM categories")}
+    new_cats = imported = skipped = 0
+    batch = []
+    start = time.perf_counter()
+
+    def flush():
+        nonlocal imported
+        db.executemany("INSERT INTO products (product_id,name,description,price,image,category_id,stock) VALUES (?,?,?,?,?,?,?) "
+                       "ON CONFLICT(product_id) DO UPDATE SET name=excluded.name, description=excluded.description, "
+                       "price=excluded.price, image=excluded.image, category_id=excluded.category_id, "
+                       "stock=COALESCE(excluded.stock, products.stock)", batch)  # no stock in the feed: keep tracking
+        db.commit()
+        imported += len(batch)
+        batch.clear()
+        echo(f"  {imported} rows  ({imported / (time.perf_counter() - start):.0f} rows/s)")
+
+    with bulk_load(db):
+        for row in read_catalog(path, fmt):
+            try:
+                name = (row.get('name') or '').strip()
+                price = float(row['price'])
+                if not math.isfinite(price):  # "nan"/"inf" parse, but can't be stored or sold
+                    raise ValueError(price)
+                pid = int(row['product_id']) if row.get('product_id') not in (None, '') else None
+                cat_id = int(row['category_id']) if row.get('category_id') not in (None, '') else None
+                stock = int(row['stock']) if row.get('stock') not in (None, '') else None
+                cat_name = str(row.get('category') or '').strip()
+            except (AttributeError, KeyError, TypeError, ValueError):
+                name = None
+            if not name:
+                skipped += 1
+                continue
+            if cat_id is None and cat_name:
+                cat_id = cats.get(cat_name)
+                if cat_id is None:
+                    cat_id = cats[cat_name] = db.execute("INSERT INTO categories (name) VALUES (?)", (cat_name,)).lastrowid
+                    new_cats += 1
+            batch.append((pid, name, row.get('description'), price, row.get('image') or None, cat_id, stock))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    db.close()
+    invalidate_nav()
+    elapsed = time.perf_counter() - start
+    echo(f"imported {imported} products ({new_cats} new categories, {skipped} skipped) "
+         f"in {elapsed:.1f}s, {imported / elapsed if elapsed else 0:.0f} rows/s")
+    return imported, skipped
+
+@app.cli.command("import-catalog")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), help="Defaults from the file extension.")
+@click.option("--batch-size", default=IMPORT_BATCH, show_default=True, help="Rows per transaction.")
+def import_catalog_command(path, fmt, batch_size):
+    """Stream a CSV/JSONL product feed into the catalog."""
+    import_catalog(path, fmt, batch_size, echo=click.echo)
+
+# ---------------- STREAMING / COMPRESSION ----------------
+# Listing pages are streamed: the header and first cards go out while the rest
+# of the page is still rendering. Text responses are gzipped for clients that
+# accept it -- whole bodies at once, streamed ones chunk by chunk with a sync
+# flush so each chunk reaches the client as soon as it's rendered.
+GZIP_TYPES = {'text/html', 'text/plain', 'text/css', 'application/javascript', 'application/json', 'application/x-ndjson'}
+
+def stream_page(template, **context):
+    """Like render_template, but streamed to the client in STREAM_CHUNK_BYTES chunks."""
+    parts = stream_template(template, **context)  # binds the request context; renders lazily
+
+    def chunks():
+        buf, size = [], 0
+        for part in parts:
+            buf.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK_BYTES:
+                yield "".join(buf)
+                buf, size = [], 0
+        if buf:
+            yield "".join(buf)
+    return app.response_class(chunks(), mimetype='text/html')
+
+def gzip_chunks(chunks):
+    z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield z.flush()
+
+@app.after_request
+def gzip_response(resp):
+    if (resp.status_code != 200 or resp.direct_passthrough or 'Content-Encoding' in resp.headers
+            or resp.mimetype not in GZIP_TYPES or not request.accept_encodings.quality('gzip')):
+        return resp
+    if resp.is_streamed:
+        resp.response = gzip_chunks(resp.iter_encoded())
+        resp.headers.pop('Content-Length', None)
+    elif resp.content_length is None or resp.content_length < GZIP_MIN_BYTES:
+        return resp
+    else:
+        resp.set_data(zlib.compress(resp.get_data(), GZIP_LEVEL, wbits=31))
+    resp.headers['Content-Encoding'] = 'gzip'
+    resp.vary.add('Accept-Encoding')
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)  # the bytes differ from the identity response
+    return resp
+
+# ---------------- SERVER ----------------
+# `flask --app app serve` runs the app under gunicorn (optional dependency):
+# SERVER_WORKERS pre-forked processes with SERVER_THREADS threads each. The app,
+# its compiled templates and the autocomplete index are loaded once in the
+# master and shared copy-on-write; each worker then opens its db connections
+# and loads the category nav before it accepts a request. `kill -HUP <master>`
+# swaps in fresh workers gracefully: new ones warm up while the old ones get
+# SERVER_GRACEFUL_TIMEOUT seconds to finish what they're serving.
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # no gunicorn: `python app.py` dev server only
+    BaseApplication = object
+
+def warm_up():
+    """Fill this process's connection pools and load the category nav."""
+    with app.test_request_context():
+        for readonly, size in ((True, DB_POOL_SIZE), (False, DB_WRITERS)):
+            pool = get_pool(readonly)
+            conns = [pool.acquire() for _ in range(size)]
+            for conn in conns:
+                pool.release(conn)
+        nav_data()
+
+def preload():
+    """Master-side setup shared by every worker; its db connection is closed before forking."""
+    warm_templates()
+    db = connect(DB)
+    try:
+        migrate(db)  # an older db is upgraded once here, before any worker reads it
+        _autocomplete['index'] = load_prefix_index(db)
+    finally:
+        db.close()
+    gc.freeze()  # keep the collector from touching (and un-sharing) the preloaded objects' pages
+
+class ShopServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        preload()
+        return app
+
+@app.cli.command("serve")
+@click.option("--bind", default=SERVER_BIND, show_default=True)
+@click.option("--workers", default=SERVER_WORKERS, show_default=True, help="Worker processes.")
+@click.option("--threads", default=SERVER_THREADS, show_default=True, help="Request threads per worker.")
+def serve_command(bind, workers, threads):
+    """Serve with pre-forked gunicorn workers, each warmed up before it takes traffic."""
+    if BaseApplication is object:
+        raise click.ClickException("gunicorn is not installed (pip install gunicorn)")
+    if not os.path.exists(DB):
+        raise click.ClickException(f"{DB} not found; create it from schema.sql first")
+    ShopServer({
+        'bind': bind, 'workers': workers, 'threads': threads, 'worker_class': 'gthread',
+        'preload_app': True, 'graceful_timeout': SERVER_GRACEFUL_TIMEOUT,
+        'post_fork': lambda server, worker: warm_up(),
+    }).run()
 
 # ---------------- RUN ----------------
 if __name__ == "__main__":
     if not os.path.exists(DB):
         print("Database not found. Create it from schema.sql or place ecommerce.db in this folder.")
+    else:
+        with app.app_context():
+            autocomplete_index()  # build before the first keystroke arrives
     app.run(debug=True)
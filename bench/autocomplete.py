@@ -0,0 +1,62 @@
+# bench/autocomplete.py - autocomplete index latency
+#
+#   python bench/autocomplete.py --products 1000000
+#
+# Builds an app.PrefixIndex over --products synthetic names (drawn from the
+# same WORDS as bench/datagen.py, with skewed sales counts), then times
+# --queries lookups for prefixes typed one character at a time. Prints build
+# time, per-query p50/p99/max in microseconds (one-word and two-word queries
+# separately), and the cost of incremental updates.
+import argparse, os, random, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app as shop
+from datagen import WORDS
+
+def pct(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+def main():
+    ap = argparse.ArgumentParser(description="Autocomplete index latency")
+    ap.add_argument("--products", type=int, default=1000000)
+    ap.add_argument("--queries", type=int, default=20000)
+    ap.add_argument("--limit", type=int, default=shop.AUTOCOMPLETE_LIMIT)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rnd = random.Random(args.seed)
+
+    rows = [(i, f"{rnd.choice(WORDS).title()} {rnd.choice(WORDS)} {i}", int(rnd.paretovariate(1.2)) - 1)
+            for i in range(1, args.products + 1)]
+    t0 = time.perf_counter()
+    index = shop.PrefixIndex(rows)
+    print(f"products={args.products} words={len(index.words)} build={time.perf_counter() - t0:.1f}s")
+
+    typed = []
+    for _ in range(args.queries // 4 + 1):
+        word = rnd.choice(WORDS) if rnd.random() < 0.8 else str(rnd.randint(1, args.products))
+        typed.extend(word[:n] for n in range(1, len(word) + 1))
+        if rnd.random() < 0.2:
+            typed.append(f"{word} {rnd.choice(WORDS)[:2]}")
+    typed = typed[:args.queries]
+    for label, qs in (("one word", [q for q in typed if " " not in q]), ("two words", [q for q in typed if " " in q])):
+        samples = []
+        for q in qs:
+            t = time.perf_counter()
+            index.search(q, args.limit)
+            samples.append((time.perf_counter() - t) * 1e6)
+        samples.sort()
+        print(f"{label}: queries={len(samples)} p50={pct(samples, .5):.0f}us p99={pct(samples, .99):.0f}us max={samples[-1]:.0f}us")
+
+    samples = []
+    for i in range(1000):
+        pid = rnd.randint(1, args.products)
+        t = time.perf_counter()
+        index.add(pid, f"{rnd.choice(WORDS).title()} {rnd.choice(WORDS)} {pid}", rnd.randint(0, 50))
+        samples.append((time.perf_counter() - t) * 1e6)
+    samples.sort()
+    print(f"updates=1000 p50={pct(samples, .5):.0f}us p99={pct(samples, .99):.0f}us max={samples[-1]:.0f}us")
+
+if __name__ == "__main__":
+    main()
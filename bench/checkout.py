@@ -0,0 +1,73 @@
+# bench/checkout.py - concurrent checkout throughput
+#
+#   python bench/checkout.py --buyers 32 --rounds 10
+#
+# Builds a throwaway db from schema.sql, then runs many logged-in buyers at once,
+# each filling a cart and posting the checkout form (every form is posted twice,
+# like a double click). Prints orders/sec and checks that the retries did not
+# create duplicate orders.
+import argparse, hashlib, os, re, sqlite3, sys, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import app as shop
+
+def build_db(path, buyers, products=200):
+    conn = sqlite3.connect(path)
+    with open(os.path.join(ROOT, "schema.sql")) as f:
+        conn.executescript(f.read())
+    conn.execute("INSERT INTO categories (name) VALUES ('Bench')")
+    conn.executemany("INSERT INTO products (name,description,price,category_id) VALUES (?,?,?,1)",
+                     [(f"Product {i}", "bench item", 10 + i % 50) for i in range(products)])
+    pw = hashlib.sha256(b"bench").hexdigest()
+    conn.executemany("INSERT INTO users (username,email,password) VALUES (?,?,?)",
+                     [(f"buyer{i}", f"buyer{i}@bench", pw) for i in range(buyers)])
+    conn.commit()
+    conn.close()
+
+def buyer(i, rounds, items, start, results):
+    client = shop.app.test_client()
+    client.post("/login", data={"email": f"buyer{i}@bench", "password": "bench"})
+    start.wait()
+    placed = 0
+    for r in range(rounds):
+        for k in range(items):
+            client.get(f"/add_to_cart/{(i * items + k + r) % 200 + 1}")
+        token = re.search(rb'name="token" value="([^"]+)"', client.get("/checkout").data).group(1).decode()
+        for _ in range(2):  # double submit
+            resp = client.post("/checkout", data={"payment_mode": "cod", "token": token})
+            assert resp.status_code == 200, resp.status_code
+        placed += 1
+    results[i] = placed
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent checkout throughput")
+    ap.add_argument("--buyers", type=int, default=32, help="concurrent buyers (threads)")
+    ap.add_argument("--rounds", type=int, default=10, help="checkouts per buyer")
+    ap.add_argument("--items", type=int, default=3, help="cart lines per checkout")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    shop.DB = os.path.join(tmp, "bench.db")
+    build_db(shop.DB, args.buyers)
+
+    start = threading.Barrier(args.buyers + 1)
+    results = {}
+    threads = [threading.Thread(target=buyer, args=(i, args.rounds, args.items, start, results)) for i in range(args.buyers)]
+    for t in threads: t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+
+    conn = sqlite3.connect(shop.DB)
+    orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    items = conn.execute("SELECT COUNT(*) FROM order_items").fetchone()[0]
+    expected = sum(results.values())
+    print(f"buyers={args.buyers} checkouts={expected} (each posted twice) elapsed={elapsed:.2f}s")
+    print(f"orders/sec={orders / elapsed:.1f}  orders={orders}  order_items={items}")
+    print("duplicates: none" if orders == expected else f"DUPLICATES: {orders - expected}")
+    return 0 if orders == expected else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
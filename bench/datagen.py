@@ -0,0 +1,102 @@
+# bench/datagen.py - synthetic ecommerce.db at production scale
+#
+#   python bench/datagen.py bench.db --products 1000000 --categories 100 \
+#       --users 100000 --orders 1000000 --order-items 5000000
+#
+# Creates the db from schema.sql and fills it with seeded random data in large
+# executemany batches (all triggers and indexes deferred via app.bulk_load, as
+# nothing serves the db yet). Every user's email is user<N>@bench with password
+# "bench", which bench/load.py logs in with. Product names draw from WORDS so
+# search terms always hit.
+import argparse, array, hashlib, os, random, sys, time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import app as shop
+
+WORDS = ("red blue green black white steel wooden classic smart mini pro ultra "
+         "lamp chair table phone laptop camera shirt shoe watch bottle bag book "
+         "speaker cable charger mug desk pillow blanket kettle knife").split()
+BATCH = 100000
+PASSWORD = "bench"
+
+def batched(rows, size=BATCH):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def fill(db, sql, rows, label, total):
+    start, done = time.perf_counter(), 0
+    for batch in batched(rows):
+        db.executemany(sql, batch)
+        db.commit()
+        done += len(batch)
+        print(f"  {label}: {done}/{total} ({done / (time.perf_counter() - start):.0f} rows/s)", end="\r")
+    print()
+
+def generate(path, products, categories, users, orders, order_items, seed=1):
+    rnd = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    db = shop.connect(path)
+    with open(os.path.join(ROOT, "schema.sql")) as f:
+        db.executescript(f.read())
+    prices = array.array("d", (round(rnd.uniform(50, 5000), 2) for _ in range(products)))
+    now = datetime.now()
+    pw = hashlib.sha256(PASSWORD.encode()).hexdigest()
+
+    with shop.bulk_load(db, ("products", "categories", "users", "orders", "order_items"), drop_all=True):
+        fill(db, "INSERT INTO categories (category_id,name) VALUES (?,?)",
+             ((i, f"Category {i}") for i in range(1, categories + 1)), "categories", categories)
+        fill(db, "INSERT INTO products (product_id,name,description,price,image,category_id) VALUES (?,?,?,?,NULL,?)",
+             ((i, f"{rnd.choice(WORDS).title()} {rnd.choice(WORDS)} {i}", " ".join(rnd.choices(WORDS, k=12)),
+               prices[i - 1], rnd.randint(1, categories)) for i in range(1, products + 1)), "products", products)
+        fill(db, "INSERT INTO users (user_id,username,email,password,is_admin) VALUES (?,?,?,?,0)",
+             ((i, f"user{i}", f"user{i}@bench", pw) for i in range(1, users + 1)), "users", users)
+
+        per_order = max(1, order_items // max(1, orders))
+        order_rows, item_rows = [], []
+        def orders_and_items():
+            # yields order rows while queueing their items, so both stay streaming
+            for oid in range(1, orders + 1):
+                lines = [(rnd.randint(1, products), rnd.randint(1, 3)) for _ in range(rnd.randint(1, 2 * per_order - 1))]
+                item_rows.extend((oid, pid, qty, prices[pid - 1]) for pid, qty in lines)
+                created = now - timedelta(seconds=rnd.randint(0, 2 * 365 * 86400))
+                yield (oid, rnd.randint(1, users), round(sum(prices[p - 1] * q for p, q in lines), 2),
+                       "Placed - COD", created.strftime("%Y-%m-%d %H:%M:%S"))
+                if len(item_rows) >= BATCH:
+                    db.executemany("INSERT INTO order_items (order_id,product_id,quantity,price) VALUES (?,?,?,?)", item_rows)
+                    item_rows.clear()
+        fill(db, "INSERT INTO orders (order_id,user_id,total_amount,status,created_at) VALUES (?,?,?,?,?)",
+             orders_and_items(), "orders", orders)
+        db.executemany("INSERT INTO order_items (order_id,product_id,quantity,price) VALUES (?,?,?,?)", item_rows)
+        db.commit()
+        print("  rebuilding indexes and search...")
+    counts = {t: db.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+              for t in ("products", "categories", "users", "orders", "order_items")}
+    db.execute("ANALYZE")
+    db.close()
+    return counts
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic ecommerce.db")
+    ap.add_argument("path", nargs="?", default="bench.db")
+    ap.add_argument("--products", type=int, default=100000)
+    ap.add_argument("--categories", type=int, default=100)
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--orders", type=int, default=100000)
+    ap.add_argument("--order-items", type=int, default=500000, help="approximate total")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    start = time.perf_counter()
+    counts = generate(args.path, args.products, args.categories, args.users, args.orders, args.order_items, args.seed)
+    print(f"{args.path}: {counts} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
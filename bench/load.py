@@ -0,0 +1,116 @@
+# bench/load.py - per-route latency and throughput
+#
+#   python bench/datagen.py bench.db            # once
+#   python bench/load.py bench.db --concurrency 1,8,32 --requests 400 --out result.json
+#
+# Drives every route of app.py through the Flask test client from N threads
+# (one logged-in client per thread, users from datagen) and prints JSON with
+# p50/p95/p99 latency and requests/sec per route and concurrency level, so
+# runs on different commits can be diffed.
+import argparse, json, os, random, re, sqlite3, subprocess, sys, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import app as shop
+from datagen import WORDS, PASSWORD
+
+def login(client, user_id):
+    client.post("/login", data={"email": f"user{user_id}@bench", "password": PASSWORD})
+
+def place_order(client, rnd, max_product):
+    """Fill the cart and fetch a checkout form; returns the timed POST as a thunk."""
+    client.get(f"/add_to_cart/{rnd.randint(1, max_product)}")
+    token = re.search(rb'name="token" value="([^"]+)"', client.get("/checkout").data).group(1).decode()
+    return lambda: client.post("/checkout", data={"payment_mode": "cod", "token": token})
+
+def routes(sizes):
+    """route name -> fn(client, rnd) returning a thunk that issues the timed request."""
+    p, c = sizes["products"], sizes["categories"]
+    return {
+        "index": lambda cl, r: lambda: cl.get(f"/?page={r.randint(1, 5)}"),
+        "index_search": lambda cl, r: lambda: cl.get(f"/?q={r.choice(WORDS)}+{r.choice(WORDS)}"),
+        "category": lambda cl, r: lambda: cl.get(f"/category/{r.randint(1, c)}"),
+        "category_sorted": lambda cl, r: lambda: cl.get(f"/category/{r.randint(1, c)}?sort={r.choice(['price_asc', 'price_desc', 'bestselling'])}"
+                                                        f"&min_price={r.choice([100, 500, 1000])}"),
+        "product": lambda cl, r: lambda: cl.get(f"/product/{r.randint(1, p)}"),
+        "cart": lambda cl, r: lambda: cl.get("/cart"),
+        "checkout_post": lambda cl, r: place_order(cl, r, p),
+        "orders": lambda cl, r: lambda: cl.get("/orders"),
+    }
+
+def percentile(sorted_ms, q):
+    return round(sorted_ms[min(len(sorted_ms) - 1, int(q * len(sorted_ms)))], 3)
+
+def run_route(make, concurrency, requests, users, seed):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    start = threading.Barrier(concurrency + 1)
+    per_thread = max(1, requests // concurrency)
+
+    def worker(n):
+        rnd = random.Random(seed + n)
+        client = shop.app.test_client()
+        login(client, (n % users) + 1)
+        client.get("/add_to_cart/1")  # so /cart has something to show
+        start.wait()
+        mine = []
+        for _ in range(per_thread):
+            thunk = make(client, rnd)
+            t0 = time.perf_counter()
+            resp = thunk()
+            resp.get_data()  # streamed pages render while the body is read
+            resp.close()
+            mine.append((time.perf_counter() - t0) * 1000)
+            if resp.status_code >= 400:
+                errors.append(resp.status_code)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads: t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {"requests": len(latencies), "errors": len(errors), "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": percentile(latencies, 0.50), "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99), "max_ms": round(latencies[-1], 3)}
+
+def main():
+    ap = argparse.ArgumentParser(description="Per-route load test against a generated db")
+    ap.add_argument("db", nargs="?", default="bench.db")
+    ap.add_argument("--concurrency", default="1,8,32", help="comma-separated thread counts")
+    ap.add_argument("--requests", type=int, default=400, help="requests per route per level")
+    ap.add_argument("--routes", help="comma-separated subset of routes")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="also write the JSON here")
+    args = ap.parse_args()
+
+    shop.DB = os.path.abspath(args.db)
+    conn = sqlite3.connect(shop.DB)
+    sizes = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0]
+             for t in ("products", "categories", "users", "orders", "order_items")}
+    conn.close()
+    table = routes(sizes)
+    names = args.routes.split(",") if args.routes else list(table)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    report = {"commit": commit, "db": sizes, "requests_per_route": args.requests, "results": {}}
+    for level in [int(c) for c in args.concurrency.split(",")]:
+        level_results = report["results"][f"c{level}"] = {}
+        for name in names:
+            level_results[name] = run_route(table[name], level, args.requests, sizes["users"], args.seed)
+            print(f"c={level:<3} {name:<14} {level_results[name]}", file=sys.stderr)
+
+    out = json.dumps(report, indent=2)
+    print(out)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(out + "\n")
+
+if __name__ == "__main__":
+    main()
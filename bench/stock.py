@@ -0,0 +1,70 @@
+# bench/stock.py - checkout contention on one scarce product
+#
+#   python bench/stock.py --buyers 200 --stock 50
+#
+# Builds a throwaway db from schema.sql with a single product holding --stock
+# units, then lets --buyers logged-in buyers (each with --qty in the cart) hit
+# the checkout form at the same moment. Prints checkouts/sec and checks that
+# stock never went negative and that every unit sold came out of stock.
+import argparse, hashlib, os, re, sqlite3, sys, tempfile, threading, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import app as shop
+
+def build_db(path, buyers, stock):
+    conn = sqlite3.connect(path)
+    with open(os.path.join(ROOT, "schema.sql")) as f:
+        conn.executescript(f.read())
+    conn.execute("INSERT INTO categories (name) VALUES ('Bench')")
+    conn.execute("INSERT INTO products (name,description,price,category_id,stock) VALUES ('Scarce','bench item',10,1,?)", (stock,))
+    pw = hashlib.sha256(b"bench").hexdigest()
+    conn.executemany("INSERT INTO users (username,email,password) VALUES (?,?,?)",
+                     [(f"buyer{i}", f"buyer{i}@bench", pw) for i in range(buyers)])
+    conn.commit()
+    conn.close()
+
+def buyer(i, qty, start, results):
+    client = shop.app.test_client()
+    client.post("/login", data={"email": f"buyer{i}@bench", "password": "bench"})
+    for _ in range(qty):
+        client.get("/add_to_cart/1")
+    token = re.search(rb'name="token" value="([^"]+)"', client.get("/checkout").data).group(1).decode()
+    start.wait()
+    resp = client.post("/checkout", data={"payment_mode": "cod", "token": token})
+    results[i] = resp.status_code
+
+def main():
+    ap = argparse.ArgumentParser(description="Checkout contention on one scarce product")
+    ap.add_argument("--buyers", type=int, default=200, help="concurrent buyers (threads)")
+    ap.add_argument("--stock", type=int, default=50, help="units of the product in stock")
+    ap.add_argument("--qty", type=int, default=1, help="units each buyer tries to buy")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    shop.DB = os.path.join(tmp, "bench.db")
+    shop.DB_POOL_TIMEOUT = 120  # every buyer queues on the one writer
+    build_db(shop.DB, args.buyers, args.stock)
+
+    start = threading.Barrier(args.buyers + 1)
+    results = {}
+    threads = [threading.Thread(target=buyer, args=(i, args.qty, start, results)) for i in range(args.buyers)]
+    for t in threads: t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+
+    conn = sqlite3.connect(shop.DB)
+    left = conn.execute("SELECT stock FROM products WHERE product_id=1").fetchone()[0]
+    sold = conn.execute("SELECT COALESCE(SUM(quantity),0) FROM order_items").fetchone()[0]
+    orders = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    errors = sum(1 for s in results.values() if s >= 500)
+    print(f"buyers={args.buyers} stock={args.stock} qty={args.qty} elapsed={elapsed:.2f}s")
+    print(f"checkouts/sec={len(results) / elapsed:.1f}  orders={orders}  sold={sold}  left={left}  errors={errors}")
+    ok = left >= 0 and sold == args.stock - left and sold <= args.stock and errors == 0
+    print("stock consistent" if ok else "STOCK MISMATCH")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
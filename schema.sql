@@ -1,3 +1,13 @@
+DROP TABLE IF EXISTS co_purchases;
+DROP TABLE IF EXISTS batch_jobs;
+DROP TABLE IF EXISTS sales_daily;
+DROP TABLE IF EXISTS sales_products;
+DROP TABLE IF EXISTS sales_categories;
+DROP TABLE IF EXISTS cart_items;
+DROP TABLE IF EXISTS carts;
+DROP TABLE IF EXISTS catalog_changes;
+DROP TABLE IF EXISTS catalog_meta;
+DROP TABLE IF EXISTS products_fts;
 DROP TABLE IF EXISTS users;
 DROP TABLE IF EXISTS products;
 DROP TABLE IF EXISTS orders;
@@ -23,6 +33,8 @@ CREATE TABLE products (
     price REAL NOT NULL,
     image TEXT,
     category_id INTEGER,
+    stock INTEGER,  -- units left; NULL = not tracked
+    sold INTEGER NOT NULL DEFAULT 0,  -- units sold, kept by checkout
     FOREIGN KEY (category_id) REFERENCES categories(category_id)
 );
 
@@ -32,8 +44,10 @@ CREATE TABLE orders (
     total_amount REAL,
     status TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    checkout_token TEXT,
     FOREIGN KEY (user_id) REFERENCES users(user_id)
 );
+CREATE UNIQUE INDEX idx_orders_checkout_token ON orders(checkout_token);
 
 CREATE TABLE order_items (
     order_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -44,3 +58,125 @@ CREATE TABLE order_items (
     FOREIGN KEY (order_id) REFERENCES orders(order_id),
     FOREIGN KEY (product_id) REFERENCES products(product_id)
 );
+
+-- hot-path indexes (category listing, order history, order items)
+CREATE INDEX idx_products_category ON products(category_id, product_id);
+CREATE INDEX idx_orders_user_created ON orders(user_id, created_at, order_id);
+CREATE INDEX idx_order_items_order ON order_items(order_id, product_id, quantity, price);
+-- listing sorts (price, best selling), with and without a category
+CREATE INDEX idx_products_price ON products(price, product_id);
+CREATE INDEX idx_products_category_price ON products(category_id, price, product_id);
+CREATE INDEX idx_products_sold ON products(sold, product_id);
+CREATE INDEX idx_products_category_sold ON products(category_id, sold, product_id);
+
+-- full-text search index over products, kept in sync by triggers
+CREATE VIRTUAL TABLE products_fts USING fts5(name, description, content='products', content_rowid='product_id');
+CREATE TRIGGER products_fts_ai AFTER INSERT ON products BEGIN
+  INSERT INTO products_fts(rowid, name, description) VALUES (new.product_id, new.name, new.description);
+END;
+CREATE TRIGGER products_fts_ad AFTER DELETE ON products BEGIN
+  INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.product_id, old.name, old.description);
+END;
+CREATE TRIGGER products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+  INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.product_id, old.name, old.description);
+  INSERT INTO products_fts(rowid, name, description) VALUES (new.product_id, new.name, new.description);
+END;
+
+-- catalog versions, bumped by triggers so caches know when products/categories change
+CREATE TABLE catalog_meta (key TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0, updated_at INTEGER NOT NULL DEFAULT 0);
+INSERT INTO catalog_meta (key, version, updated_at) VALUES ('products', 0, CAST(strftime('%s','now') AS INTEGER)), ('categories', 0, CAST(strftime('%s','now') AS INTEGER));
+CREATE TRIGGER products_version_ai AFTER INSERT ON products BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='products';
+END;
+CREATE TRIGGER products_version_au AFTER UPDATE OF name, description, price, image, category_id ON products BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='products';
+END;
+-- stock changes only matter to pages when a product sells out or comes back
+CREATE TRIGGER products_version_stock AFTER UPDATE OF stock ON products WHEN (COALESCE(old.stock, 1) > 0) != (COALESCE(new.stock, 1) > 0) BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='products';
+END;
+CREATE TRIGGER products_version_ad AFTER DELETE ON products BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='products';
+END;
+CREATE TRIGGER categories_version_ai AFTER INSERT ON categories BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='categories';
+END;
+CREATE TRIGGER categories_version_au AFTER UPDATE ON categories BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='categories';
+END;
+CREATE TRIGGER categories_version_ad AFTER DELETE ON categories BEGIN
+  UPDATE catalog_meta SET version=version+1, updated_at=CAST(strftime('%s','now') AS INTEGER) WHERE key='categories';
+END;
+
+-- product changes log, read by the page cache for targeted invalidation
+CREATE TABLE catalog_changes (change_id INTEGER PRIMARY KEY AUTOINCREMENT, product_id INTEGER, category_id INTEGER);
+CREATE TRIGGER products_changes_ai AFTER INSERT ON products BEGIN
+  INSERT INTO catalog_changes (product_id, category_id) VALUES (new.product_id, new.category_id);
+  DELETE FROM catalog_changes WHERE change_id <= (SELECT MAX(change_id) FROM catalog_changes) - 10000;
+END;
+CREATE TRIGGER products_changes_au AFTER UPDATE OF name, description, price, image, category_id ON products BEGIN
+  INSERT INTO catalog_changes (product_id, category_id) VALUES (old.product_id, old.category_id), (new.product_id, new.category_id);
+  DELETE FROM catalog_changes WHERE change_id <= (SELECT MAX(change_id) FROM catalog_changes) - 10000;
+END;
+CREATE TRIGGER products_changes_stock AFTER UPDATE OF stock ON products WHEN (COALESCE(old.stock, 1) > 0) != (COALESCE(new.stock, 1) > 0) BEGIN
+  INSERT INTO catalog_changes (product_id, category_id) VALUES (new.product_id, new.category_id);
+  DELETE FROM catalog_changes WHERE change_id <= (SELECT MAX(change_id) FROM catalog_changes) - 10000;
+END;
+CREATE TRIGGER products_changes_ad AFTER DELETE ON products BEGIN
+  INSERT INTO catalog_changes (product_id, category_id) VALUES (old.product_id, old.category_id);
+  DELETE FROM catalog_changes WHERE change_id <= (SELECT MAX(change_id) FROM catalog_changes) - 10000;
+END;
+
+-- server-side carts; the session only stores cart_id
+CREATE TABLE carts (
+    cart_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+CREATE INDEX idx_carts_user ON carts(user_id);
+CREATE TABLE cart_items (
+    cart_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (cart_id, product_id),
+    FOREIGN KEY (cart_id) REFERENCES carts(cart_id),
+    FOREIGN KEY (product_id) REFERENCES products(product_id)
+) WITHOUT ROWID;
+
+-- running sales totals for the admin dashboard (category_id 0 = uncategorised)
+CREATE TABLE sales_daily (
+    day TEXT PRIMARY KEY,
+    orders INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE sales_products (
+    product_id INTEGER PRIMARY KEY,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX idx_sales_products_revenue ON sales_products(revenue, product_id);
+CREATE TABLE sales_categories (
+    category_id INTEGER PRIMARY KEY,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX idx_sales_categories_revenue ON sales_categories(revenue, category_id);
+
+-- "frequently bought together": strongest co-purchase pairs per product,
+-- filled by `flask build-recommendations`; batch_jobs remembers its last order
+CREATE TABLE co_purchases (
+    product_id INTEGER NOT NULL,
+    related_id INTEGER NOT NULL,
+    orders INTEGER NOT NULL,
+    PRIMARY KEY (product_id, related_id)
+) WITHOUT ROWID;
+CREATE INDEX idx_co_purchases_top ON co_purchases(product_id, orders, related_id);
+CREATE TABLE batch_jobs (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL DEFAULT 0);
+
+-- triggers/indexes a running bulk load has dropped; migrate() restores leftovers
+CREATE TABLE deferred_ddl (name TEXT PRIMARY KEY, tbl_name TEXT NOT NULL, sql TEXT NOT NULL);
+
+-- latest migration in app.py MIGRATIONS; older dbs are upgraded in place
+PRAGMA user_version = 11;
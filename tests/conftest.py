@@ -0,0 +1,47 @@
+import hashlib, os, sqlite3, sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import app as shop_app
+
+def hash_pw(pw):
+    return hashlib.sha256(pw.encode()).hexdigest()
+
+@pytest.fixture
+def shop(tmp_path, monkeypatch):
+    """app.py on a fresh db from schema.sql: 3 categories, 40 products, an admin
+    and a demo user. Process-wide caches are swapped for empty ones."""
+    path = tmp_path / "ecommerce.db"
+    db = sqlite3.connect(path)
+    with open(os.path.join(ROOT, "schema.sql")) as f:
+        db.executescript(f.read())
+    db.execute("INSERT INTO users (username,email,password,is_admin) VALUES ('admin','admin@example.com',?,1)", (hash_pw("admin"),))
+    db.execute("INSERT INTO users (username,email,password,is_admin) VALUES ('demo','demo@example.com',?,0)", (hash_pw("demo"),))
+    db.executemany("INSERT INTO categories (name) VALUES (?)", [("Books",), ("Toys",), ("Food",)])
+    db.executemany("INSERT INTO products (name,description,price,category_id) VALUES (?,?,?,?)",
+                   [(f"Widget {i} {'red' if i % 2 else 'blue'}", f"desc number {i} gadget", i * 1.5, i % 3 + 1) for i in range(1, 41)])
+    db.commit()
+    db.close()
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(shop_app, "DB", str(path))
+    monkeypatch.setattr(shop_app, "_schema_ready", False)
+    monkeypatch.setattr(shop_app, "page_cache", shop_app.PageCache(shop_app.PAGE_CACHE_BYTES, shop_app.PAGE_CACHE_TTL))
+    monkeypatch.setattr(shop_app, "_nav", {'version': None, 'checked': 0.0, 'cats': [], 'dropdown_html': ''})
+    monkeypatch.setattr(shop_app, "_count_cache", {})
+    monkeypatch.setattr(shop_app, "_facet_cache", {'version': None, 'matrix': {}})
+    monkeypatch.setattr(shop_app, "_autocomplete", {'index': None, 'rebuilding': False})
+    shop_app.app.config['TESTING'] = True
+    return shop_app
+
+@pytest.fixture
+def client(shop):
+    return shop.app.test_client()
+
+def write(shop, sql, params=()):
+    """Run one write on its own connection, as another process would."""
+    db = shop.connect(shop.DB)
+    db.execute(sql, params)
+    db.commit()
+    db.close()
@@ -0,0 +1,67 @@
+import random, re, threading, time
+
+import app as shop_app
+
+WORDS = ("red blue green black white steel wooden classic smart mini pro ultra "
+         "lamp chair table phone laptop camera shirt shoe watch bottle bag book").split()
+
+def build(n, seed):
+    rnd = random.Random(seed)
+    rows = [(i, f"{rnd.choice(WORDS).title()} {rnd.choice(WORDS)} {i}", int(rnd.paretovariate(1.2)) - 1) for i in range(1, n + 1)]
+    return shop_app.PrefixIndex(rows), rnd
+
+def brute_force(index, q, limit):
+    tokens = re.findall(r"\w+", q.lower())
+    hits = sorted((index.scores[pid], pid, name) for pid, name in index.names.items()
+                  if all(any(w.startswith(t) for w in shop_app.name_words(name)) for t in tokens))
+    return [(pid, name) for _, pid, name in hits[:limit]]
+
+def test_search_matches_brute_force_after_edits():
+    index, rnd = build(3000, 2)
+    for _ in range(300):
+        pid = rnd.randint(1, 3000)
+        if rnd.random() < 0.3:
+            index.remove(pid)
+        else:
+            index.add(pid, f"{rnd.choice(WORDS).title()} {rnd.choice(WORDS)} {pid}", rnd.randint(0, 30))
+    queries = [f"{a[:rnd.randint(1, len(a))]} {b[:rnd.randint(1, len(b))]}" for a in WORDS[::3] for b in WORDS]
+    queries += ["la", "lamp", "12 la", "la 12", "1 b", "red red", "lamp lamp 1", "2999 l", "zzz", "blue red 1"]
+    for q in queries:
+        assert index.search(q, 8) == brute_force(index, q, 8), q
+
+def test_search_survives_concurrent_edits():
+    index, _ = build(2000, 3)
+    stop, errors = time.time() + 2, []
+
+    def writer():
+        rnd = random.Random(4)
+        while time.time() < stop:
+            pid = rnd.randint(1, 2000)
+            with shop_app._autocomplete_lock:
+                if rnd.random() < 0.5:
+                    index.remove(pid)
+                else:
+                    index.add(pid, f"{rnd.choice(WORDS).title()} zz{rnd.randint(0, 9)} {pid}", rnd.randint(0, 20))
+
+    def reader(seed):
+        rnd = random.Random(seed)
+        while time.time() < stop:
+            a, b = rnd.choice(WORDS + ['zz']), rnd.choice(WORDS + ['zz'])
+            try:
+                index.search(rnd.choice([a[:rnd.randint(1, len(a))], f"{a[:3]} {b[:2]}", "zz", "zz1 l"]))
+            except Exception as e:
+                errors.append(repr(e))
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader, args=(i,)) for i in range(3)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert errors == []
+
+def test_endpoint_follows_catalog_changes(shop, client):
+    from conftest import write
+    assert len(client.get('/api/autocomplete?q=wid').get_json()['results']) == shop.AUTOCOMPLETE_LIMIT
+    write(shop, "UPDATE products SET name='Gizmo deluxe' WHERE product_id=5")
+    write(shop, "INSERT INTO products (name, price, category_id) VALUES ('Gizmotron', 3, 1)")
+    names = {r['name'] for r in client.get('/api/autocomplete?q=giz').get_json()['results']}
+    assert names == {'Gizmo deluxe', 'Gizmotron'}
+    assert client.get('/api/autocomplete?q=').get_json()['results'] == []
@@ -0,0 +1,68 @@
+import json
+
+from conftest import write
+
+def objects(db):
+    return [r[0] for r in db.execute("SELECT name FROM sqlite_master WHERE type IN ('trigger', 'index') ORDER BY name")]
+
+def test_import_upserts_and_searches(shop, client):
+    with open("feed.jsonl", "w") as f:
+        for i in range(300):
+            f.write(json.dumps({'name': f'Imported {i}', 'price': i + 0.5, 'category': f'Cat {i % 7}'}) + "\n")
+        f.write(json.dumps({'product_id': 3, 'name': 'Renamed three', 'price': 1, 'category': 'Books'}) + "\n")
+    assert shop.import_catalog("feed.jsonl", batch_size=100, echo=lambda *a: None) == (301, 0)
+    assert b'Imported 299' in client.get('/?q=imported').data
+    assert b'Renamed three' in client.get('/product/3').data
+    assert b'Cat 6' in client.get('/login').data  # new category in the nav
+
+def test_bad_feed_rows_are_skipped(shop):
+    with open("bad.jsonl", "w") as f:
+        f.write('{"name": "Good one", "price": 5}\n{not json\n["x"]\n"str"\n'
+                '{"name": "Nan price", "price": "nan"}\n{"name": "Inf price", "price": "inf"}\n'
+                '{"name": 7, "price": 1}\n{"name": "Good two", "price": 6}\n')
+    assert shop.import_catalog("bad.jsonl", echo=lambda *a: None) == (2, 6)
+    with open("bad.csv", "w") as f:
+        f.write("name,price\nCsv nan,nan\nCsv good,2\n")
+    assert shop.import_catalog("bad.csv", echo=lambda *a: None) == (1, 1)
+
+def test_import_keeps_stock_unless_given(shop):
+    write(shop, "UPDATE products SET stock=7 WHERE product_id=4")
+    with open("nostock.csv", "w") as f:
+        f.write("product_id,name,price\n4,Widget four again,9.5\n")
+    shop.import_catalog("nostock.csv", echo=lambda *a: None)
+    db = shop.connect(shop.DB)
+    assert tuple(db.execute("SELECT stock, name FROM products WHERE product_id=4").fetchone()) == (7, 'Widget four again')
+    with open("stock.csv", "w") as f:
+        f.write("product_id,name,price,stock\n4,Widget four again,9.5,3\n")
+    shop.import_catalog("stock.csv", echo=lambda *a: None)
+    assert db.execute("SELECT stock FROM products WHERE product_id=4").fetchone()[0] == 3
+
+def test_bulk_load_keeps_lookup_indexes_and_restores(shop, client):
+    db = shop.connect(shop.DB)
+    before = objects(db)
+    try:
+        with shop.bulk_load(db):
+            assert db.execute("SELECT COUNT(*) FROM deferred_ddl").fetchone()[0] == 3  # the FTS triggers
+            assert objects(db) != before and 'idx_products_category' in objects(db)
+            db.execute("INSERT INTO products (name, price) VALUES ('Crashy thing', 1)")
+            db.commit()
+            raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+    assert objects(db) == before
+    assert b'Crashy thing' in client.get('/?q=crashy').data
+
+def test_migrate_restores_after_a_killed_load(shop, client):
+    db = shop.connect(shop.DB)
+    before = objects(db)
+    # what a killed bulk_load leaves behind: triggers dropped, their DDL recorded
+    db.execute("BEGIN IMMEDIATE")
+    for row in db.execute("SELECT name, tbl_name, sql FROM sqlite_master WHERE type='trigger' AND sql LIKE '%products_fts%'").fetchall():
+        db.execute("INSERT INTO deferred_ddl VALUES (?,?,?)", tuple(row))
+        db.execute(f"DROP TRIGGER {row['name']}")
+    db.commit()
+    write(shop, "INSERT INTO products (name, price) VALUES ('Orphan gizmo', 1)")
+    shop.migrate(shop.connect(shop.DB))
+    assert objects(db) == before
+    assert db.execute("SELECT COUNT(*) FROM deferred_ddl").fetchone()[0] == 0
+    assert b'Orphan gizmo' in client.get('/?q=gizmo').data
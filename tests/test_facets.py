@@ -0,0 +1,35 @@
+from conftest import write
+
+RANGES = [(None, None), (100, 500), (None, 100), (2500, None), (100, 100), (500, 100),
+          (0.01, None), (None, 99.99), (7.5, 30), (30, 7.5), (99.99, 500.5), (150, 3000.5), (-5, 1e9)]
+
+def expected(db, category_id, min_price, max_price):
+    conds, params = ["1"], []
+    if category_id is not None:
+        conds.append("category_id=?"); params.append(category_id)
+    if min_price is not None:
+        conds.append("price >= ?"); params.append(min_price)
+    if max_price is not None:
+        conds.append("price < ?"); params.append(max_price)
+    return db.execute(f"SELECT COUNT(*) FROM products WHERE {' AND '.join(conds)}", params).fetchone()[0]
+
+def test_facets_match_a_direct_count(shop, monkeypatch):
+    for price, cid in ((99.99, 1), (100, 2), (450, None), (500, 1), (1000, 3), (2499.5, 2), (2500, 2), (3000, None)):
+        write(shop, "INSERT INTO products (name, price, category_id) VALUES ('Edge case', ?, ?)", (price, cid))
+    passes = []
+    facet_sql = shop.facet_sql
+    monkeypatch.setattr(shop, "facet_sql", lambda: passes.append(1) or facet_sql())
+    db = shop.connect(shop.DB)
+    with shop.app.test_request_context():
+        for min_price, max_price in RANGES:
+            for category_id in (None, 1, 2):
+                facets = shop.listing_facets(category_id, min_price, max_price)
+                assert facets['total'] == expected(db, category_id, min_price, max_price), (category_id, min_price, max_price)
+                assert all(c['count'] == expected(db, c['category_id'], min_price, max_price) for c in facets['categories'])
+                assert [p['count'] for p in facets['prices']] == [expected(db, category_id, lo, hi) for _, lo, hi in shop.price_buckets()]
+    assert len(passes) == 1  # one grouped pass for every range
+
+def test_arbitrary_ranges_are_not_cached(shop, client):
+    for i in range(50):
+        assert client.get(f'/api/products?min_price={i}.25').status_code == 200
+    assert set(shop._facet_cache) == {'version', 'matrix'}
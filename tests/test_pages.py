@@ -0,0 +1,64 @@
+import base64, gzip, json, os
+
+from conftest import write
+
+def cursor(*parts):
+    return base64.urlsafe_b64encode(json.dumps(list(parts)).encode()).decode().rstrip("=")
+
+def test_bad_cursor_and_page_args(shop, client):
+    for token in (cursor("n", 2, {"a": 1}), cursor("n", 2, [1]), cursor("p", 2, None), "garbage"):
+        assert shop.decode_cursor(token) is None
+        assert client.get(f'/?cursor={token}').status_code == 200
+        assert client.get(f'/api/products?cursor={token}').status_code == 200
+    for url in ('/?page=x', '/category/1?page=x', '/api/products?page=x', '/api/categories/1?page=x'):
+        assert client.get(url).status_code == 200, url
+
+def test_cached_page_shows_new_category_in_nav(shop, client):
+    client.get('/category/1').get_data()  # a streamed page is cached once it has been sent
+    assert client.get('/category/1').headers['X-Cache'] == 'HIT'
+    write(shop, "INSERT INTO categories (name) VALUES ('Orchard')")
+    assert b'Orchard' in client.get('/category/1').data
+    hit = client.get('/category/1')
+    assert hit.headers['X-Cache'] == 'HIT' and b'Orchard' in hit.data
+
+def test_streamed_listing_is_cached_and_gzipped(shop, client):
+    miss = client.get('/category/1?sort=price_asc')
+    assert miss.is_streamed and miss.headers['X-Cache'] == 'MISS'
+    body = miss.get_data()
+    hit = client.get('/category/1?sort=price_asc')
+    assert hit.headers['X-Cache'] == 'HIT' and hit.get_data() == body
+    z = client.get('/category/1?sort=price_asc', headers={'Accept-Encoding': 'gzip'})
+    assert z.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in z.headers['Vary']
+    assert gzip.decompress(z.get_data()) == body
+    etag = z.headers['ETag']
+    assert etag.startswith('W/')
+    assert client.get('/category/1?sort=price_asc', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+    streamed = client.get('/?sort=price_desc', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Length' not in streamed.headers and b'Featured Products' in gzip.decompress(streamed.get_data())
+    assert 'Content-Encoding' not in client.get('/api/autocomplete?q=zz', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.get('/category/2', headers={'Accept-Encoding': 'gzip;q=0'}).headers
+
+def test_streamed_render_time_reaches_metrics(shop, client):
+    for i in range(3):
+        resp = client.get(f'/?sort=price_asc&n={i}')
+        resp.get_data()
+        resp.close()
+    metrics = client.get('/metrics').get_data(as_text=True)
+    render = [l for l in metrics.splitlines() if l.startswith(f'lunashop_request_render_seconds_sum{{pid="{os.getpid()}",route="index"}}')]
+    assert render and float(render[0].split()[-1]) > 0
+    assert f'lunashop_page_cache_hits_total{{pid="{os.getpid()}"}}' in metrics
+    assert client.get('/cache/stats').get_json()['pid'] == os.getpid()
+
+def test_warm_up_fills_the_pool(shop):
+    shop.warm_up()
+    assert len(shop.get_pool(True)._idle.queue) == shop.DB_POOL_SIZE
+
+def test_product_page_follows_related_products(shop, client):
+    write(shop, "INSERT INTO co_purchases (product_id, related_id, orders) VALUES (1, 2, 5)")
+    first = client.get('/product/1')
+    assert b'Widget 2 blue' in first.data
+    assert client.get('/product/1').headers['X-Cache'] == 'HIT'
+    write(shop, "UPDATE products SET name='Widget two renamed', price=99 WHERE product_id=2")
+    fresh = client.get('/product/1', headers={'If-None-Match': first.headers['ETag']})
+    assert fresh.status_code == 200 and fresh.headers['X-Cache'] == 'MISS'
+    assert b'Widget two renamed' in fresh.data and b'Widget 2 blue' not in fresh.data
@@ -0,0 +1,63 @@
+# schema.sql as the app first shipped it
+ORIGINAL_SCHEMA = """
+CREATE TABLE users (
+    user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    is_admin INTEGER DEFAULT 0
+);
+CREATE TABLE categories (
+    category_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT UNIQUE NOT NULL
+);
+
+CREATE TABLE products (
+    product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    description TEXT,
+    price REAL NOT NULL,
+    image TEXT,
+    category_id INTEGER,
+    FOREIGN KEY (category_id) REFERENCES categories(category_id)
+);
+
+CREATE TABLE orders (
+    order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    total_amount REAL,
+    status TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+CREATE TABLE order_items (
+    order_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER,
+    product_id INTEGER,
+    quantity INTEGER,
+    price REAL,
+    FOREIGN KEY (order_id) REFERENCES orders(order_id),
+    FOREIGN KEY (product_id) REFERENCES products(product_id)
+);
+"""
+
+def test_hot_queries_use_indexes(shop):
+    db = shop.connect(shop.DB)
+    assert shop.query_plan_problems(db) == []
+
+def test_missing_index_is_reported(shop):
+    db = shop.connect(shop.DB)
+    db.execute("DROP INDEX idx_products_category_sold")
+    labels = {label for label, _ in shop.query_plan_problems(db)}
+    assert "category: bestselling, first page" in labels
+
+def test_migrated_db_matches_schema(shop, tmp_path):
+    # a db from the original schema upgrades to the same objects as schema.sql
+    old = shop.connect(str(tmp_path / "old.db"))
+    old.executescript(ORIGINAL_SCHEMA)
+    assert shop.migrate(old) == shop.MIGRATIONS[-1][0]
+    new = shop.connect(shop.DB)
+    objects = "SELECT type, name FROM sqlite_master WHERE type IN ('index', 'trigger') AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    assert old.execute(objects).fetchall() == new.execute(objects).fetchall()
+    assert shop.query_plan_problems(old) == []